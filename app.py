@@ -1,20 +1,44 @@
-from flask import Flask
+from dotenv import load_dotenv
+
+# Before anything reads Config, which takes DATABASE_URL from the environment
+load_dotenv()
+
+from flask import Flask, jsonify
 from flask_cors import CORS
-from src.database import engine
+from config import Config
+from src.database import engine, upgrade_schema, init_app
 import src.models as models
-from dotenv import load_dotenv
 from src.routes.auth import auth_router
-from src.routes.upload import upload_router
+from src.routes.upload import upload_router, ingest_queue
 from src.routes.chat import chat_router
 from src.routes.mcq import mcq_router
 from src.routes.flash import flashcard_router
-
-load_dotenv()
+from src.vector_gc import start_reconciler
+from src.rag_chain import warm_up
+from src.resources import resources
+from src.question_bank import bank_builder
+import src.metrics as metrics
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["X-Has-More", "X-Cursor-Before", "X-Cursor-After"])
+init_app(app)
+metrics.init_app(app)
 
 models.Base.metadata.create_all(bind=engine)
+upgrade_schema()
+
+# Spawned PDF extraction workers re-import the main module as __mp_main__
+# when started with `python app.py`; they must not start background work
+if __name__ != "__mp_main__":
+    ingest_queue.start()
+    start_reconciler()
+    if Config.WARM_UP_ON_START:
+        resources.start_warm_up(warm_up, Config.WARM_UP_RETRY_SECONDS)
+    else:
+        # Nothing to wait for, resources load on the first request that needs them
+        resources.ready.set()
+    if Config.QUESTION_BANK_ENABLED:
+        bank_builder.start()
 
 
 @app.route("/", methods=["GET"])
@@ -22,6 +46,19 @@ def index():
     return "Hello server is working"
 
 
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    # The process is up and serving requests
+    return "ok"
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    # Ready once the models and vector store have been warmed up
+    status = resources.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+
 app.register_blueprint(chat_router, url_prefix="/api/chat")
 
 app.register_blueprint(upload_router, url_prefix="/api/upload")
@@ -0,0 +1,17 @@
+# Async serving mode. /api/chat streams answers on the event loop so one
+# worker can hold many open streams; every other route is served by the
+# Flask app.
+#
+#   uvicorn asgi:app --host 0.0.0.0 --port 5000
+from fastapi import FastAPI
+from fastapi.middleware.wsgi import WSGIMiddleware
+from app import app as flask_app
+from src.database import init_async_db
+from src.routes.chat_async import chat_async_router
+
+app = FastAPI()
+init_async_db()
+
+app.include_router(chat_async_router, prefix="/api/chat")
+
+app.mount("/", WSGIMiddleware(flask_app))
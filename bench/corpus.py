@@ -0,0 +1,45 @@
+import random
+
+# Deterministic synthetic study notes. Words come from a fixed made-up
+# vocabulary so keyword and question queries have something to hit.
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "xe", "zu", "bra", "cle", "dri", "fto", "gru"]
+
+
+def vocabulary(size=3000, seed=7):
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+VOCABULARY = vocabulary()
+
+
+def make_text(chars, seed):
+    # Paragraphs of sentences, with Zipf-like word frequencies
+    rng = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(len(VOCABULARY))]
+    parts = []
+    size = 0
+    while size < chars:
+        sentence = " ".join(rng.choices(VOCABULARY, weights=weights, k=rng.randint(8, 20)))
+        sentence = sentence.capitalize() + ". "
+        if rng.random() < 0.15:
+            sentence += "\n\n"
+        parts.append(sentence)
+        size += len(sentence)
+    return "".join(parts)[:chars]
+
+
+def make_queries(count, seed, words=(2, 6)):
+    rng = random.Random(seed)
+    common = VOCABULARY[:500]
+    return [" ".join(rng.choices(common, k=rng.randint(*words))) for _ in range(count)]
+
+
+def write_text_file(path, chars, seed):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(make_text(chars, seed))
+    return path
@@ -0,0 +1,163 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from config import Config
+
+# Offline benchmarks against the fake embedding and LLM backends.
+#
+#   python -m bench.run                       # every scenario, default sizes
+#   python -m bench.run chat --streams 1,8,32
+#   python -m bench.run ingest retrieval --llm-rate 30 --out results.json
+#   python -m bench.run --quick               # smoke run, tiny sizes and latencies
+#
+# Each run works in a scratch directory (database, Chroma, caches) and
+# writes one JSON file, by default under bench/results/. The exit status
+# is 1 when any request in the run failed.
+
+SCENARIOS = ("ingest", "retrieval", "chat", "chat_async", "generation")
+
+# --quick: just enough of every scenario to know it still runs
+QUICK = {
+    "ingest_kb": [16],
+    "corpus_chunks": [50],
+    "queries": 3,
+    "streams": [1, 2],
+    "turns": 1,
+    "requests": 1,
+    "corpus_kb": 16,
+    "embed_latency": 0.0,
+    "embed_latency_per_text": 0.0,
+    "llm_ttft": 0.01,
+    "llm_rate": 1000,
+    "llm_tokens": 20,
+}
+
+
+def int_list(value):
+    return [int(part) for part in value.split(",") if part]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m bench.run")
+    parser.add_argument("scenarios", nargs="*", help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--ingest-kb", type=int_list, default=[64, 512, 2048], help="file sizes to ingest")
+    parser.add_argument("--corpus-chunks", type=int_list, default=[500, 2000, 8000], help="retrieval corpus sizes")
+    parser.add_argument("--queries", type=int, default=50, help="queries per retrieval mode")
+    parser.add_argument("--streams", type=int_list, default=[1, 4, 16], help="concurrent chat streams")
+    parser.add_argument("--turns", type=int, default=3, help="chat turns per stream")
+    parser.add_argument("--requests", type=int, default=5, help="MCQ/flashcard requests")
+    parser.add_argument("--corpus-kb", type=int, default=256, help="corpus size for the chat and generation scenarios")
+    parser.add_argument("--embed-latency", type=float, default=Config.FAKE_EMBEDDING_LATENCY)
+    parser.add_argument("--embed-latency-per-text", type=float, default=Config.FAKE_EMBEDDING_LATENCY_PER_TEXT)
+    parser.add_argument("--llm-ttft", type=float, default=Config.FAKE_LLM_TIME_TO_FIRST_TOKEN)
+    parser.add_argument("--llm-rate", type=float, default=Config.FAKE_LLM_TOKENS_PER_SECOND)
+    parser.add_argument("--llm-tokens", type=int, default=Config.FAKE_LLM_RESPONSE_TOKENS)
+    parser.add_argument("--workdir", help="keep the scratch data here instead of a temporary directory")
+    parser.add_argument("--out", help="results file (default bench/results/<timestamp>.json)")
+    parser.add_argument("--quick", action="store_true", help="smoke run with tiny sizes, overrides the options above")
+    args = parser.parse_args(argv)
+    if args.quick:
+        for name, value in QUICK.items():
+            setattr(args, name, value)
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+    return args
+
+
+def configure(args, workdir):
+    # Must run before anything under src/ is imported: the database,
+    # vector store and caches are created from Config at import time
+    Config.EMBEDDING_BACKEND = "fake"
+    Config.LLM_BACKEND = "fake"
+    Config.FAKE_EMBEDDING_LATENCY = args.embed_latency
+    Config.FAKE_EMBEDDING_LATENCY_PER_TEXT = args.embed_latency_per_text
+    Config.FAKE_LLM_TIME_TO_FIRST_TOKEN = args.llm_ttft
+    Config.FAKE_LLM_TOKENS_PER_SECOND = args.llm_rate
+    Config.FAKE_LLM_RESPONSE_TOKENS = args.llm_tokens
+
+    Config.DATABASE_URL = f"sqlite:///{os.path.join(workdir, 'app.db')}"
+    Config.ASYNC_DATABASE_URL = None
+    Config.CHROMA_DIR = os.path.join(workdir, "chroma_db")
+    Config.UPLOAD_FOLDER = os.path.join(workdir, "uploads")
+    Config.EMBEDDING_CACHE_PATH = os.path.join(workdir, "embedding_cache.db")
+    Config.RESULT_CACHE_PATH = os.path.join(workdir, "result_cache.db")
+    Config.LEXICAL_INDEX_PATH = os.path.join(workdir, "lexical.db")
+    Config.GC_INTERVAL_SECONDS = 0
+    # Background bank building would compete with the scenarios for the fake LLM
+    Config.QUESTION_BANK_ENABLED = False
+    os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def settings():
+    # Everything in Config that can change a result, for comparing runs
+    return {
+        name: getattr(Config, name) for name in dir(Config)
+        if name.isupper() and isinstance(getattr(Config, name), (int, float, str, bool))
+        and not name.endswith(("_PATH", "_DIR", "_FOLDER", "_URL"))
+    }
+
+
+def failed(results):
+    return any(run.get("errors") for result in results.values() for run in result.get("runs", []))
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rune-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    configure(args, workdir)
+
+    from bench import scenarios
+
+    fixture = scenarios.Fixture()
+    results = {}
+    for name in args.scenarios:
+        print(f"running {name}...", flush=True)
+        start = time.perf_counter()
+        if name == "ingest":
+            results[name] = scenarios.ingest_scenario(fixture, args.ingest_kb)
+        elif name == "retrieval":
+            results[name] = scenarios.retrieval_scenario(fixture, args.corpus_chunks, args.queries)
+        elif name == "chat":
+            results[name] = scenarios.chat_scenario(fixture, args.streams, args.turns, corpus_kb=args.corpus_kb)
+        elif name == "chat_async":
+            results[name] = scenarios.chat_async_scenario(fixture, args.streams, args.turns, corpus_kb=args.corpus_kb)
+        elif name == "generation":
+            results[name] = scenarios.generation_scenario(fixture, args.requests, corpus_kb=args.corpus_kb)
+        results[name]["wall_seconds"] = time.perf_counter() - start
+
+    report = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "workdir": workdir,
+        "config": settings(),
+        "results": results,
+    }
+
+    out = args.out or os.path.join(os.path.dirname(__file__), "results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {out}")
+    return report
+
+
+if __name__ == "__main__":
+    sys.exit(1 if failed(main()["results"]) else 0)
@@ -0,0 +1,365 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+import jwt
+from app import app
+from config import Config
+from src.database import SessionLocal
+from src.documents import chat_content_hashes, scope_filter
+from src.index_manager import index_manager
+from src.lexical import lexical_index
+from src.models import Chat, File, FileStatusEnum, FileTypeEnum, User, generate_uuid
+from src.rag_chain import create_retriever
+from src.retrieval import retrieve_context_for_keywords
+from src.routes.auth import JWT_SECRET
+from src.routes.upload import process_file
+from bench.corpus import make_queries, write_text_file
+
+# Imported by bench.run once Config points at a scratch directory and the
+# fake backends. Every scenario returns a JSON-serialisable dict.
+
+CHARS_PER_CHUNK = Config.CHUNK_SIZE - Config.CHUNK_OVERLAP
+
+
+def summarize(samples):
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+    n = len(samples)
+
+    def percentile(p):
+        return samples[min(n - 1, int(round(p / 100 * (n - 1))))]
+
+    return {
+        "count": n,
+        "mean": sum(samples) / n,
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "p99": percentile(99),
+        "max": samples[-1],
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+class Fixture:
+    # A user with a token and helpers to make chats and ingest files
+
+    def __init__(self):
+        db = SessionLocal()
+        try:
+            user = User(name="bench", email=f"bench-{generate_uuid()}@example.com", password_hash="-")
+            db.add(user)
+            db.commit()
+            self.user_id = user.user_id
+        finally:
+            db.close()
+
+        token = jwt.encode({
+            "user_id": self.user_id,
+            "exp": datetime.utcnow() + timedelta(hours=12)
+        }, JWT_SECRET, algorithm="HS256")
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def chat(self, title="bench"):
+        db = SessionLocal()
+        try:
+            chat = Chat(title=title, user_id=self.user_id)
+            db.add(chat)
+            db.commit()
+            return chat.chat_id
+        finally:
+            db.close()
+
+    def ingest(self, chat_id, chars, seed):
+        # Straight through process_file, the same path a queued upload takes
+        path = write_text_file(os.path.join(Config.UPLOAD_FOLDER, f"{generate_uuid()}.txt"), chars, seed)
+        db = SessionLocal()
+        try:
+            file = File(file_name=os.path.basename(path), chat_id=chat_id, file_type="notes", status="pending")
+            db.add(file)
+            db.commit()
+            file_id = file.file_id
+        finally:
+            db.close()
+
+        seconds, ok = timed(process_file, path, chat_id, file_id)
+        if not ok:
+            raise RuntimeError(f"process_file failed for {path}")
+
+        db = SessionLocal()
+        try:
+            document = db.get(File, file_id).document
+            return seconds, document.content_hash, document.chunk_count
+        finally:
+            db.close()
+
+    def share(self, chat_id, content_hash):
+        # Attach an already processed document to another chat
+        db = SessionLocal()
+        try:
+            db.add(File(
+                file_name=f"{content_hash[:8]}.txt",
+                chat_id=chat_id,
+                file_type=FileTypeEnum.notes,
+                status=FileStatusEnum.processed,
+                content_hash=content_hash
+            ))
+            db.commit()
+            index_manager.ensure_document(db, content_hash, index_manager.partition_for(self.user_id, chat_id))
+        finally:
+            db.close()
+
+
+def ingest_scenario(fixture, sizes_kb):
+    runs = []
+    for i, size in enumerate(sizes_kb):
+        chat_id = fixture.chat(f"ingest {size}KB")
+        seconds, _, chunks = fixture.ingest(chat_id, size * 1024, seed=1000 + i)
+        runs.append({
+            "size_kb": size,
+            "chunks": chunks,
+            "seconds": seconds,
+            "chunks_per_second": chunks / seconds if seconds else None,
+            "kb_per_second": size / seconds if seconds else None,
+        })
+    return {"runs": runs}
+
+
+def retrieval_scenario(fixture, corpus_chunks, queries):
+    runs = []
+    for i, chunks in enumerate(corpus_chunks):
+        chat_id = fixture.chat(f"retrieval {chunks}")
+        ingest_seconds, _, actual_chunks = fixture.ingest(chat_id, chunks * CHARS_PER_CHUNK, seed=2000 + i)
+
+        db = SessionLocal()
+        try:
+            hashes = chat_content_hashes(db, chat_id)
+        finally:
+            db.close()
+        search_filter = scope_filter(chat_id, hashes)
+        store = index_manager.for_chat(fixture.user_id, chat_id)
+
+        # Fresh questions per mode so the query embedding cache doesn't hide the cost
+        latencies = {}
+        questions = make_queries(queries * 3, seed=3000 + i)
+        modes = {
+            "vector": lambda q: create_retriever(store, search_filter).invoke(q),
+            "hybrid": lambda q: create_retriever(store, search_filter, hashes).invoke(q),
+            "lexical": lambda q: lexical_index.search(q, hashes, 5),
+        }
+        for m, (mode, search) in enumerate(modes.items()):
+            latencies[mode] = summarize([timed(search, q)[0] for q in questions[m * queries:(m + 1) * queries]])
+
+        keywords = make_queries(queries * 2, seed=4000 + i, words=(1, 2))
+        for m, mode in enumerate(("hybrid", "lexical")):
+            batch = keywords[m * queries:(m + 1) * queries]
+            latencies[f"keywords_{mode}"] = summarize([
+                timed(retrieve_context_for_keywords, store, batch[j:j + 5], search_filter, hashes, mode=mode)[0]
+                for j in range(0, len(batch), 5)
+            ])
+
+        runs.append({
+            "corpus_chunks": actual_chunks,
+            "collection_chunks": store._collection.count(),
+            "ingest_seconds": ingest_seconds,
+            "latency_seconds": latencies,
+        })
+    return {"runs": runs}
+
+
+def stream_chat(client, headers, chat_id, message):
+    # Returns (time to first token, total seconds, tokens)
+    start = time.perf_counter()
+    first = None
+    tokens = 0
+    response = client.post("/api/chat/", json={"chat_id": chat_id, "message": message},
+                           headers=headers, buffered=False)
+    try:
+        if response.status_code != 200:
+            raise RuntimeError(f"chat returned {response.status_code}: {response.get_data(as_text=True)}")
+        for block in response.response:
+            for event in block.decode("utf-8").split("\n\n"):
+                if event.startswith("event: token"):
+                    tokens += 1
+                    if first is None:
+                        first = time.perf_counter() - start
+                elif event.startswith("event: error"):
+                    raise RuntimeError(event)
+    finally:
+        response.close()
+    return first, time.perf_counter() - start, tokens
+
+
+def stream_stats(streams, samples, errors, wall):
+    total_tokens = sum(tokens for _, _, tokens in samples)
+    return {
+        "streams": streams,
+        "requests": len(samples),
+        "errors": errors[:10],
+        "ttfb_seconds": summarize([first for first, _, _ in samples if first is not None]),
+        "total_seconds": summarize([total for _, total, _ in samples]),
+        "tokens_per_second_per_stream": summarize([
+            tokens / (total - first) for first, total, tokens in samples
+            if first is not None and total > first
+        ]),
+        "aggregate_tokens_per_second": total_tokens / wall if wall else None,
+    }
+
+
+def chat_corpus(fixture, corpus_kb, seed):
+    base_chat = fixture.chat("chat corpus")
+    _, content_hash, _ = fixture.ingest(base_chat, corpus_kb * 1024, seed=seed)
+    return content_hash
+
+
+def shared_chats(fixture, streams, content_hash):
+    chats = []
+    for _ in range(streams):
+        chat_id = fixture.chat(f"chat x{streams}")
+        fixture.share(chat_id, content_hash)
+        chats.append(chat_id)
+    return chats
+
+
+def chat_scenario(fixture, concurrency, turns, corpus_kb):
+    content_hash = chat_corpus(fixture, corpus_kb, seed=5000)
+
+    runs = []
+    for streams in concurrency:
+        chats = shared_chats(fixture, streams, content_hash)
+
+        samples = []
+        errors = []
+        lock = threading.Lock()
+
+        def user(index, chat_id):
+            client = app.test_client()
+            for turn, question in enumerate(make_queries(turns, seed=6000 + streams * 100 + index)):
+                try:
+                    result = stream_chat(client, fixture.headers, chat_id, question)
+                except Exception as e:
+                    with lock:
+                        errors.append(str(e))
+                    continue
+                with lock:
+                    samples.append(result)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=user, args=(i, chat_id)) for i, chat_id in enumerate(chats)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+        runs.append(stream_stats(streams, samples, errors, wall))
+    return {"runs": runs}
+
+
+def serve_asgi():
+    # The ASGI app under uvicorn on a free local port. A real server rather
+    # than an in-process transport so responses actually stream.
+    import uvicorn
+    from asgi import app as asgi_app
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("uvicorn failed to start")
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+async def stream_chat_async(client, headers, chat_id, message):
+    # Same as stream_chat, over HTTP against the async endpoint
+    start = time.perf_counter()
+    first = None
+    tokens = 0
+    async with client.stream("POST", "/api/chat/", json={"chat_id": chat_id, "message": message},
+                             headers=headers) as response:
+        if response.status_code != 200:
+            body = await response.aread()
+            raise RuntimeError(f"chat returned {response.status_code}: {body.decode('utf-8', 'replace')}")
+        buffer = ""
+        async for text in response.aiter_text():
+            buffer += text
+            while "\n\n" in buffer:
+                event, buffer = buffer.split("\n\n", 1)
+                if event.startswith("event: token"):
+                    tokens += 1
+                    if first is None:
+                        first = time.perf_counter() - start
+                elif event.startswith("event: error"):
+                    raise RuntimeError(event)
+    return first, time.perf_counter() - start, tokens
+
+
+def chat_async_scenario(fixture, concurrency, turns, corpus_kb):
+    # The uvicorn / FastAPI chat endpoint, every stream on one event loop
+    import httpx
+
+    content_hash = chat_corpus(fixture, corpus_kb, seed=9000)
+    server, thread, base_url = serve_asgi()
+
+    async def run(streams, chats):
+        samples = []
+        errors = []
+
+        async def user(index, chat_id, client):
+            for question in make_queries(turns, seed=10000 + streams * 100 + index):
+                try:
+                    samples.append(await stream_chat_async(client, fixture.headers, chat_id, question))
+                except Exception as e:
+                    errors.append(str(e))
+
+        limits = httpx.Limits(max_connections=streams)
+        async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+            await asyncio.gather(*(user(i, chat_id, client) for i, chat_id in enumerate(chats)))
+        return samples, errors
+
+    runs = []
+    try:
+        for streams in concurrency:
+            chats = shared_chats(fixture, streams, content_hash)
+            start = time.perf_counter()
+            samples, errors = asyncio.run(run(streams, chats))
+            runs.append(stream_stats(streams, samples, errors, time.perf_counter() - start))
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+    return {"runs": runs}
+
+
+def generation_scenario(fixture, requests, corpus_kb):
+    chat_id = fixture.chat("generation corpus")
+    fixture.ingest(chat_id, corpus_kb * 1024, seed=7000)
+    client = app.test_client()
+
+    results = {}
+    for kind, path in (("mcq", f"/api/mcq/{chat_id}/"), ("flashcard", f"/api/flashcard/{chat_id}/")):
+        cold = []
+        warm = []
+        for i, keywords in enumerate(make_queries(requests, seed=8000 + len(kind), words=(2, 5))):
+            keywords = keywords.split()
+            seconds, response = timed(client.post, path, json={"keywords": keywords, "regenerate": True},
+                                      headers=fixture.headers)
+            if response.status_code != 200:
+                raise RuntimeError(f"{kind} returned {response.status_code}: {response.get_data(as_text=True)}")
+            cold.append(seconds)
+            # Same keywords again are served from the result cache
+            warm.append(timed(client.post, path, json={"keywords": keywords}, headers=fixture.headers)[0])
+        results[kind] = {"generated_seconds": summarize(cold), "cached_seconds": summarize(warm)}
+    return results
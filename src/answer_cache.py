@@ -0,0 +1,114 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from langchain_core.messages import HumanMessage
+from config import Config
+from src.metrics import watch_cache
+
+
+def chunk_ids(docs):
+    return tuple(sorted(doc.id or hashlib.sha1(doc.page_content.encode()).hexdigest() for doc in docs))
+
+
+def corpus_key(chat_id, hashes, syllabus):
+    # What an answer is drawn from: the documents in scope (a content hash
+    # always names the same chunks, so chats over the same notes share
+    # entries) and the syllabus topics given to the model. Chunks written
+    # before content hashing are only tagged with their chat.
+    corpus = tuple(sorted(hashes)) if hashes else ("chat", chat_id)
+    return corpus, hashlib.sha1((syllabus or "").encode()).hexdigest()
+
+
+def is_cacheable(inputs):
+    # Only first questions are cached, later answers depend on the conversation
+    if not Config.ANSWER_CACHE_ENABLED or inputs["history_summary"]:
+        return False
+    return not any(isinstance(message, HumanMessage) for message in inputs["chat_history"])
+
+
+class AnswerCache:
+    # Answers to history-free questions, per corpus (see corpus_key). A
+    # lookup hits when the same chunks were retrieved and the question
+    # embedding is close enough to one asked before, in any chat over the
+    # same documents.
+
+    def __init__(self, max_corpora=Config.ANSWER_CACHE_MAX_CORPORA, per_corpus=Config.ANSWER_CACHE_PER_CORPUS,
+                 ttl=Config.ANSWER_CACHE_TTL, threshold=Config.ANSWER_CACHE_SIMILARITY):
+        self.max_corpora = max_corpora
+        self.per_corpus = per_corpus
+        self.ttl = ttl
+        self.threshold = threshold
+
+        self.corpora = OrderedDict()  # corpus key -> list of entries
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+
+    def _normalize(self, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) + 1e-10)
+
+    def lookup(self, corpus, vector, ids):
+        query = self._normalize(vector)
+        now = time.time()
+        with self.lock:
+            entries = self.corpora.get(corpus)
+            if entries:
+                self.corpora.move_to_end(corpus)
+                entries[:] = [entry for entry in entries if now - entry["created"] < self.ttl]
+                for entry in entries:
+                    if entry["ids"] == ids and float(entry["vector"] @ query) >= self.threshold:
+                        self.hits += 1
+                        return entry["answer"]
+            self.misses += 1
+            return None
+
+    def store(self, corpus, vector, ids, answer):
+        with self.lock:
+            entries = self.corpora.setdefault(corpus, [])
+            self.corpora.move_to_end(corpus)
+
+            entries.append({
+                "vector": self._normalize(vector),
+                "ids": ids,
+                "answer": answer,
+                "created": time.time()
+            })
+            del entries[:-self.per_corpus]
+            self.stores += 1
+
+            while len(self.corpora) > self.max_corpora:
+                self.corpora.popitem(last=False)
+
+    def invalidate(self, chat_id, hashes=()):
+        # The chat's files changed. Entries keyed on its legacy chunks go,
+        # and to be safe so do those over any of the documents it uses.
+        hashes = set(hashes)
+        with self.lock:
+            for key in list(self.corpora):
+                corpus = key[0]
+                if corpus == ("chat", chat_id) or hashes.intersection(corpus):
+                    del self.corpora[key]
+                    self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "invalidations": self.invalidations,
+                "corpora": len(self.corpora),
+                "entries": sum(len(entries) for entries in self.corpora.values()),
+            }
+
+
+answer_cache = AnswerCache()
+watch_cache("answers", answer_cache.stats, entries="entries")
@@ -0,0 +1,130 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class PersistentLRUCache:
+    # Two tier cache: a small in-memory LRU in front of a SQLite table.
+    # Values are bytes. The disk tier is trimmed by total size, dropping
+    # the least recently used rows first.
+
+    def __init__(self, path, table, max_items, max_bytes):
+        self.table = table
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed_at ON {table} (accessed_at)")
+        self.conn.commit()
+
+        self.disk_bytes = self.conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {table}").fetchone()[0]
+
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return self.memory[key]
+
+            row = self.conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            self.hits += 1
+            self._remember(key, row[0])
+            return row[0]
+
+    def set(self, key, value):
+        self.set_many([(key, value)])
+
+    def set_many(self, items):
+        with self.lock:
+            now = time.time()
+            for key, value in items:
+                old = self.conn.execute(f"SELECT size FROM {self.table} WHERE key = ?", (key,)).fetchone()
+                if old:
+                    self.disk_bytes -= old[0]
+                self.conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, size, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value, len(value), now)
+                )
+                self.disk_bytes += len(value)
+                self._remember(key, value)
+            self.conn.commit()
+
+            if self.disk_bytes > self.max_bytes:
+                self._evict()
+
+    def delete(self, key):
+        with self.lock:
+            self.memory.pop(key, None)
+            row = self.conn.execute(f"SELECT size FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row:
+                self.conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self.conn.commit()
+                self.disk_bytes -= row[0]
+
+    def delete_prefix(self, prefix):
+        with self.lock:
+            for key in [key for key in self.memory if key.startswith(prefix)]:
+                del self.memory[key]
+            pattern = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            row = self.conn.execute(
+                f"SELECT COALESCE(SUM(size), 0) FROM {self.table} WHERE key LIKE ? ESCAPE '\\'", (pattern,)
+            ).fetchone()
+            self.conn.execute(f"DELETE FROM {self.table} WHERE key LIKE ? ESCAPE '\\'", (pattern,))
+            self.conn.commit()
+            self.disk_bytes -= row[0]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "memory_items": len(self.memory),
+                "disk_bytes": self.disk_bytes,
+            }
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+
+    def _evict(self):
+        # Trim to 90% of the budget so we don't evict on every insert
+        target = int(self.max_bytes * 0.9)
+        while self.disk_bytes > target:
+            rows = self.conn.execute(
+                f"SELECT key, size FROM {self.table} ORDER BY accessed_at ASC LIMIT 100"
+            ).fetchall()
+            if not rows:
+                self.disk_bytes = 0
+                break
+            for key, size in rows:
+                if self.disk_bytes <= target:
+                    break
+                self.conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self.memory.pop(key, None)
+                self.disk_bytes -= size
+            self.conn.commit()
@@ -0,0 +1,94 @@
+import re
+from langchain_core.documents import Document
+from config import Config
+from src.history import estimate_tokens
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+SHINGLE_SIZE = 3
+
+
+def shingles(text):
+    words = WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def source_of(doc):
+    return doc.metadata.get("content_hash") or doc.metadata.get("chat_id")
+
+
+def join_overlapping(a, b):
+    # Consecutive chunks share up to CHUNK_OVERLAP characters: keep the
+    # shared text once
+    for n in range(min(len(a), len(b), Config.CHUNK_OVERLAP), 0, -1):
+        if a.endswith(b[:n]):
+            return a + b[n:]
+    return a + "\n" + b
+
+
+def merge_runs(ranked):
+    # ranked: (rank, doc) pairs. Chunks from the same source with
+    # consecutive chunk_index are merged into one block, which keeps the
+    # best rank of its parts.
+    by_source = {}
+    blocks = []
+    for rank, doc in ranked:
+        if "chunk_index" in doc.metadata and source_of(doc):
+            by_source.setdefault(source_of(doc), []).append((rank, doc))
+        else:
+            blocks.append((rank, doc))
+
+    for parts in by_source.values():
+        parts.sort(key=lambda part: part[1].metadata["chunk_index"])
+        rank, first = parts[0]
+        text = first.page_content
+        last_index = first.metadata["chunk_index"]
+        for part_rank, doc in parts[1:]:
+            index = doc.metadata["chunk_index"]
+            if index == last_index + 1:
+                text = join_overlapping(text, doc.page_content)
+                rank = min(rank, part_rank)
+            else:
+                blocks.append((rank, Document(id=first.id, page_content=text, metadata=first.metadata)))
+                rank, first, text = part_rank, doc, doc.page_content
+            last_index = index
+        blocks.append((rank, Document(id=first.id, page_content=text, metadata=first.metadata)))
+
+    blocks.sort(key=lambda block: block[0])
+    return [doc for _, doc in blocks]
+
+
+def pack_context(docs, token_budget=Config.CONTEXT_TOKEN_BUDGET,
+                 duplicate_similarity=Config.CONTEXT_DUPLICATE_SIMILARITY):
+    # Sits between retrieval and the prompt. docs are best first; the
+    # result drops near duplicates, merges neighbouring chunks and keeps
+    # the most relevant blocks that fit the token budget.
+    kept = []
+    seen = []
+    for rank, doc in enumerate(docs):
+        signature = shingles(doc.page_content)
+        if any(similarity(signature, other) >= duplicate_similarity for other in seen):
+            continue
+        seen.append(signature)
+        kept.append((rank, doc))
+
+    packed = []
+    used = 0
+    for doc in merge_runs(kept):
+        tokens = estimate_tokens(doc.page_content)
+        if used + tokens <= token_budget:
+            packed.append(doc)
+            used += tokens
+        elif not packed:
+            # Even the best block is over budget, send as much of it as fits
+            text = doc.page_content[:token_budget * 4]
+            packed.append(Document(id=doc.id, page_content=text, metadata=doc.metadata))
+            used = token_budget
+    return packed
@@ -1,20 +1,157 @@
-from sqlalchemy import create_engine
+import threading
+from flask import g
+from sqlalchemy import Enum, create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from config import Config
+
+# Async drivers for the ASGI chat endpoint, by backend. Only aiosqlite is
+# in requirements.txt; the others are optional and only needed to run
+# asgi.py against that database (see the end of requirements.txt).
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+}
+
+
+def async_database_url(url):
+    if Config.ASYNC_DATABASE_URL:
+        return Config.ASYNC_DATABASE_URL
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver known for {backend}, set ASYNC_DATABASE_URL")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+IS_SQLITE = make_url(Config.DATABASE_URL).get_backend_name() == "sqlite"
+
+
+def engine_options(poolclass):
+    # The pool is set explicitly so SQLite and server databases behave the same
+    options = {
+        "poolclass": poolclass,
+        "pool_size": Config.DB_POOL_SIZE,
+        "max_overflow": Config.DB_MAX_OVERFLOW,
+        "pool_timeout": Config.DB_POOL_TIMEOUT,
+        "pool_recycle": Config.DB_POOL_RECYCLE,
+    }
+    if not IS_SQLITE:
+        options["pool_pre_ping"] = True
+    return options
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets chat reads carry on while an ingestion thread writes, and
+    # busy_timeout makes concurrent writers wait for the lock instead of
+    # failing with "database is locked"
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={Config.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={int(Config.SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.execute(f"PRAGMA mmap_size={int(Config.SQLITE_MMAP_SIZE)}")
+    cursor.close()
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./app.db"
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    Config.DATABASE_URL,
+    # Pooled SQLite connections move between request, ingestion and summary threads
+    connect_args={"check_same_thread": False} if IS_SQLITE else {},
+    **engine_options(QueuePool)
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+if IS_SQLITE:
+    event.listen(engine, "connect", set_sqlite_pragmas)
+
+# The async engine is only used by the ASGI chat endpoint (asgi.py), so it
+# is created when that app is mounted and WSGI workers never open its pool
+_async_sessionmaker = None
+_async_lock = threading.Lock()
+
+
+def init_async_db():
+    global _async_sessionmaker
+    with _async_lock:
+        if _async_sessionmaker is None:
+            url = async_database_url(Config.DATABASE_URL)
+            try:
+                async_engine = create_async_engine(url, **engine_options(AsyncAdaptedQueuePool))
+            except ModuleNotFoundError as e:
+                raise RuntimeError(f"The async chat endpoint needs the {e.name} driver for {make_url(url).drivername}, "
+                                   f"install it or set ASYNC_DATABASE_URL") from e
+            if IS_SQLITE:
+                event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+            _async_sessionmaker = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    return _async_sessionmaker
+
+
+def async_session():
+    return (_async_sessionmaker or init_async_db())()
+
 Base = declarative_base()
 
-# Dependency to get DB session
+
 def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close() 
\ No newline at end of file
+    # One session per request, closed by close_db() when the app context is
+    # torn down. Code running outside a request (ingestion workers, background
+    # threads, CLIs) opens SessionLocal() itself and closes it.
+    if "db" not in g:
+        g.db = SessionLocal()
+    return g.db
+
+
+def close_db(exception=None):
+    db = g.pop("db", None)
+    if db is not None:
+        if exception is not None:
+            db.rollback()
+        db.close()
+
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
+
+
+def upgrade_schema():
+    # create_all() only creates missing tables, so add any columns and
+    # indexes that were introduced after an existing database was created.
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+    upgrade_enums()
+
+
+def upgrade_enums():
+    # PostgreSQL keeps enums as their own types, which don't pick up values
+    # added to the Python enum later (e.g. FileStatusEnum.failed). ADD VALUE
+    # has to be committed before the value can be used, so each runs on
+    # its own.
+    if engine.dialect.name != "postgresql":
+        return
+    types = {}
+    for table in Base.metadata.sorted_tables:
+        for column in table.columns:
+            if isinstance(column.type, Enum) and column.type.native_enum and column.type.name:
+                types[column.type.name] = column.type.enums
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name, values in types.items():
+            exists = conn.execute(text("SELECT 1 FROM pg_type WHERE typname = :name"), {"name": name}).first()
+            if not exists:
+                continue
+            for value in values:
+                conn.execute(text(f"ALTER TYPE {name} ADD VALUE IF NOT EXISTS '{value}'"))
@@ -0,0 +1,89 @@
+import hashlib
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from src.models import Chat, Document, File, FileStatusEnum, FileTypeEnum
+from src.answer_cache import answer_cache
+from src.result_cache import invalidate_results
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def save_and_hash(file_storage, file_path):
+    # Hash the upload while it is written to disk so we never read it twice
+    sha = hashlib.sha256()
+    with open(file_path, "wb") as out:
+        while True:
+            block = file_storage.stream.read(HASH_CHUNK_SIZE)
+            if not block:
+                break
+            sha.update(block)
+            out.write(block)
+    return sha.hexdigest()
+
+
+def hash_file(file_path):
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def get_or_create_document(db, content_hash):
+    document = db.get(Document, content_hash)
+    if document:
+        return document
+
+    try:
+        document = Document(content_hash=content_hash)
+        db.add(document)
+        db.commit()
+        return document
+    except IntegrityError:
+        # Another worker created it first
+        db.rollback()
+        return db.get(Document, content_hash)
+
+
+def is_document_ready(document, file_type):
+    if not document:
+        return False
+    if file_type == FileTypeEnum.syllabus.value:
+        return document.text is not None
+    return document.chunk_count is not None
+
+
+def chat_content_hashes(db, chat_id):
+    rows = db.query(File.content_hash)\
+        .filter(File.chat_id == chat_id,
+                File.file_type == FileTypeEnum.notes,
+                File.status == FileStatusEnum.processed,
+                File.content_hash.isnot(None))\
+        .distinct()\
+        .all()
+    return [row[0] for row in rows]
+
+
+def scope_filter(chat_id, hashes):
+    # Chunks are shared between chats and tagged with the hash of the file
+    # they came from. Older chunks are still tagged with a single chat_id.
+    if not hashes:
+        return {"chat_id": chat_id}
+
+    return {"$or": [
+        {"chat_id": chat_id},
+        {"content_hash": {"$in": hashes}},
+    ]}
+
+
+def chat_scope_filter(db, chat_id):
+    return scope_filter(chat_id, chat_content_hashes(db, chat_id))
+
+
+def corpus_changed(db, chat_id):
+    # Anything derived from a chat's files is stale once they change
+    db.query(Chat).filter(Chat.chat_id == chat_id)\
+        .update({Chat.corpus_version: func.coalesce(Chat.corpus_version, 0) + 1})
+    db.commit()
+    answer_cache.invalidate(chat_id, chat_content_hashes(db, chat_id))
+    invalidate_results(chat_id)
@@ -0,0 +1,67 @@
+import hashlib
+import unicodedata
+from array import array
+from langchain_core.embeddings import Embeddings
+from config import Config
+from src.cache import PersistentLRUCache
+
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFC", text)
+    return " ".join(text.split()).casefold()
+
+
+class CachedEmbeddings(Embeddings):
+    # Wraps an embeddings model and caches query embeddings keyed by
+    # (model name, normalized text). Document embeddings are passed
+    # straight through since every chunk is embedded only once anyway.
+
+    def __init__(self, embeddings, model_name, cache=None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache or PersistentLRUCache(
+            Config.EMBEDDING_CACHE_PATH,
+            "query_embeddings",
+            max_items=Config.EMBEDDING_CACHE_MEMORY_ITEMS,
+            max_bytes=Config.EMBEDDING_CACHE_MAX_BYTES
+        )
+
+    def _key(self, text):
+        raw = f"{self.model_name}\x00{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts):
+        # Cached lookups for several queries, with every miss embedded
+        # in a single batched call to the underlying model.
+        keys = [self._key(text) for text in texts]
+        vectors = [None] * len(texts)
+        missing = {}
+
+        for i, key in enumerate(keys):
+            value = self.cache.get(key)
+            if value is not None:
+                vectors[i] = array("f", value).tolist()
+            else:
+                missing.setdefault(key, []).append(i)
+
+        if missing:
+            miss_texts = [texts[positions[0]] for positions in missing.values()]
+            embedded = self.embeddings.embed_documents(miss_texts)
+
+            to_store = []
+            for (key, positions), vector in zip(missing.items(), embedded):
+                for i in positions:
+                    vectors[i] = vector
+                to_store.append((key, array("f", vector).tobytes()))
+            self.cache.set_many(to_store)
+
+        return vectors
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import math
+import re
+import time
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from config import Config
+
+# Local stand-ins for the embedding model and the LLM, selected with
+# EMBEDDING_BACKEND / LLM_BACKEND = "fake". They are deterministic and
+# only cost the configured latency, for benchmarks and offline runs.
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+FILLER = (
+    "the notes describe how each concept relates to the previous one and why it matters "
+    "for the exam so review the definitions examples and common mistakes before moving on"
+).split()
+
+
+def word_hash(word):
+    return int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class FakeEmbeddings(Embeddings):
+    # Hashed bag of words, L2 normalised, so texts sharing words end up
+    # close together and retrieval still returns sensible neighbours.
+
+    def __init__(self, dim=Config.FAKE_EMBEDDING_DIM, latency=Config.FAKE_EMBEDDING_LATENCY,
+                 latency_per_text=Config.FAKE_EMBEDDING_LATENCY_PER_TEXT):
+        self.dim = dim
+        self.latency = latency
+        self.latency_per_text = latency_per_text
+
+    def _vector(self, text):
+        vector = [0.0] * self.dim
+        for word in WORD_RE.findall(text.lower()):
+            h = word_hash(word)
+            vector[h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def _delay(self, count):
+        delay = self.latency + self.latency_per_text * count
+        if delay > 0:
+            time.sleep(delay)
+
+    def embed_documents(self, texts):
+        self._delay(len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self._delay(1)
+        return self._vector(text)
+
+
+class FakeChatModel(BaseChatModel):
+    # Streams response_tokens words after time_to_first_token, at
+    # tokens_per_second. The words depend only on the prompt.
+    time_to_first_token: float = Config.FAKE_LLM_TIME_TO_FIRST_TOKEN
+    tokens_per_second: float = Config.FAKE_LLM_TOKENS_PER_SECOND
+    response_tokens: int = Config.FAKE_LLM_RESPONSE_TOKENS
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _tokens(self, messages):
+        seed = hashlib.sha256("\n".join(str(message.content) for message in messages).encode("utf-8")).digest()
+        return [FILLER[(seed[i % len(seed)] + i) % len(FILLER)] + " " for i in range(self.response_tokens)]
+
+    def _token_delay(self):
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens(messages)
+        time.sleep(self.time_to_first_token + self._token_delay() * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.time_to_first_token)
+        for token in self._tokens(messages):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+            time.sleep(self._token_delay())
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.time_to_first_token)
+        for token in self._tokens(messages):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+            await asyncio.sleep(self._token_delay())
@@ -1,23 +1,29 @@
+from src.progress import create_progress_store
+
+
 class FileMemory:
-    files = {}
+    # Upload progress by file_id. The entries live in the configured
+    # progress store (Config.PROGRESS_BACKEND) so any worker can answer.
 
-    def __init__(self):
-        self.files = {}
+    def __init__(self, store=None):
+        self.store = store or create_progress_store()
 
     def add_file(self, file_id, file):
         file["progress"] = 0
         file["status"] = "pending"
-        self.files[file_id] = file
-        
+        self.store.add(file_id, file)
 
     def update_progress(self, file_id, progress):
-        self.files[file_id]["progress"] = progress
+        self.store.update(file_id, progress=progress)
 
     def get_file(self, file_id):
-        return self.files.get(file_id)
-    
+        return self.store.get(file_id)
+
+    def wait_for_change(self, file_id, seen, timeout):
+        return self.store.wait(file_id, seen, timeout)
+
     def set_file_completed(self, file_id):
-        self.files[file_id]["status"] = "completed"
-        
+        self.store.update(file_id, status="completed", progress=100)
 
-    
+    def set_file_failed(self, file_id):
+        self.store.update(file_id, status="failed")
@@ -0,0 +1,126 @@
+import threading
+from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.prompts import ChatPromptTemplate
+from config import Config
+from src.database import SessionLocal
+from src.models import Chat, ChatMessage
+from src.rag_chain import get_llm
+
+summary_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", "You maintain a running summary of a study conversation between a student and an assistant. "
+                  "Update the existing summary with the new messages. "
+                  "Keep the topics discussed, questions asked and important facts from the answers. "
+                  "Keep it under 300 words. Respond with the summary only.\n\n"
+                  "<summary>{summary}</summary>\n\n"
+                  "<messages>{messages}</messages>"),
+    ]
+)
+
+_summarizing = set()
+_summarizing_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    # Roughly 4 characters per token, good enough for budgeting
+    return len(text or "") // 4 + 1
+
+
+def load_window(db, chat_id):
+    # Most recent messages that fit the token budget, oldest first. Only
+    # HISTORY_MAX_MESSAGES rows are ever read from the database.
+    rows = db.query(ChatMessage)\
+        .filter(ChatMessage.chat_id == chat_id)\
+        .order_by(ChatMessage.timestamp.desc())\
+        .limit(Config.HISTORY_MAX_MESSAGES)\
+        .all()
+
+    window = []
+    used = 0
+    for message in rows:
+        cost = estimate_tokens(message.content)
+        if window and used + cost > Config.HISTORY_TOKEN_BUDGET:
+            break
+        window.append(message)
+        used += cost
+
+    window.reverse()
+    return window
+
+
+def load_history(db, chat_id, summarized_until=None):
+    window = load_window(db, chat_id)
+
+    # Messages that fell out of the window are folded into the summary
+    # HISTORY_SUMMARY_MIN_MESSAGES at a time. Until then they stay in the
+    # prompt, newest first, as far as the rest of the token budget goes.
+    # Whatever doesn't fit has the summary brought up to date.
+    if window:
+        gap = db.query(ChatMessage)\
+            .filter(ChatMessage.chat_id == chat_id, ChatMessage.timestamp < window[0].timestamp)
+        if summarized_until:
+            gap = gap.filter(ChatMessage.timestamp > summarized_until)
+        rows = gap.order_by(ChatMessage.timestamp.desc()).limit(Config.HISTORY_SUMMARY_BATCH).all()
+
+        used = sum(estimate_tokens(message.content) for message in window)
+        kept = []
+        for message in rows:
+            cost = estimate_tokens(message.content)
+            if used + cost > Config.HISTORY_TOKEN_BUDGET:
+                schedule_summary(chat_id)
+                break
+            kept.append(message)
+            used += cost
+
+        kept.reverse()
+        window = kept + window
+
+    return [AIMessage(content=msg.content) if msg.is_bot else HumanMessage(content=msg.content) for msg in window]
+
+
+def update_summary(chat_id):
+    db = SessionLocal()
+    try:
+        chat = db.get(Chat, chat_id)
+        if not chat:
+            return
+
+        window = load_window(db, chat_id)
+        if not window:
+            return
+
+        # Messages that fell out of the window and are not in the summary yet
+        query = db.query(ChatMessage)\
+            .filter(ChatMessage.chat_id == chat_id, ChatMessage.timestamp < window[0].timestamp)
+        if chat.summarized_until:
+            query = query.filter(ChatMessage.timestamp > chat.summarized_until)
+        rows = query.order_by(ChatMessage.timestamp.asc()).limit(Config.HISTORY_SUMMARY_BATCH).all()
+
+        if len(rows) < Config.HISTORY_SUMMARY_MIN_MESSAGES:
+            return
+
+        messages = "\n".join(
+            f"{'Assistant' if msg.is_bot else 'Student'}: {msg.content}" for msg in rows
+        )
+        response = get_llm().invoke(summary_prompt.format(summary=chat.history_summary or "", messages=messages))
+
+        chat.history_summary = response.text()
+        chat.summarized_until = rows[-1].timestamp
+        db.commit()
+    except Exception as e:
+        print(e)
+    finally:
+        db.close()
+        with _summarizing_lock:
+            _summarizing.discard(chat_id)
+
+
+def schedule_summary(chat_id):
+    # Fold old messages into the summary in the background, at most one
+    # summarization per chat at a time.
+    with _summarizing_lock:
+        if chat_id in _summarizing:
+            return
+        _summarizing.add(chat_id)
+
+    threading.Thread(target=update_summary, args=(chat_id,), daemon=True).start()
@@ -0,0 +1,252 @@
+import json
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+from sqlalchemy.exc import IntegrityError
+from config import Config
+from src.database import SessionLocal
+from src.models import Chat, DocumentPartition, File, FileStatusEnum, FileTypeEnum
+from src.rag_chain import get_vectorstore
+
+COPY_BATCH_SIZE = 500
+
+
+def single_partition(user_id, chat_id):
+    return get_vectorstore()._collection.name
+
+
+def user_partition(user_id, chat_id):
+    return f"user_{user_id}"
+
+
+def chat_partition(user_id, chat_id):
+    return f"chat_{chat_id}"
+
+
+def hash_partition(user_id, chat_id):
+    return f"bucket_{zlib.crc32(chat_id.encode()) % Config.VECTOR_HASH_BUCKETS}"
+
+
+STRATEGIES = {
+    "single": single_partition,
+    "user": user_partition,
+    "chat": chat_partition,
+    "hash": hash_partition,
+}
+
+
+class IndexManager:
+    # Maps a chat to the Chroma collection holding its chunks. Collections
+    # are opened on first use and kept in a bounded LRU; Chroma itself
+    # unloads idle HNSW segments when VECTOR_MEMORY_LIMIT_BYTES is set.
+    #
+    # Chunks are still stored per content hash, so when a document is
+    # needed in a partition that doesn't have it yet, its vectors are
+    # copied from a partition that does instead of being re-embedded.
+    #
+    # The default store (and with it the Chroma client) is only opened the
+    # first time a partition is needed.
+
+    def __init__(self, store_factory=get_vectorstore, strategy=Config.VECTOR_PARTITIONING,
+                 max_loaded=Config.VECTOR_MAX_LOADED_PARTITIONS):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown vector partitioning strategy: {strategy}")
+
+        self.store_factory = store_factory
+        self.strategy = strategy
+        self.partition_for = STRATEGIES[strategy]
+        self.max_loaded = max_loaded
+
+        self.loaded = OrderedDict()  # partition name -> Chroma
+        self.lock = threading.Lock()
+
+    @property
+    def default_store(self):
+        return self.store_factory()
+
+    @property
+    def client(self):
+        return self.default_store._client
+
+    @property
+    def embeddings(self):
+        return self.default_store.embeddings
+
+    def get(self, name):
+        with self.lock:
+            store = self.loaded.get(name)
+            if store is not None:
+                self.loaded.move_to_end(name)
+                return store
+
+        if name == self.default_store._collection.name:
+            store = self.default_store
+        else:
+            from langchain_chroma import Chroma
+            store = Chroma(client=self.client, collection_name=name, embedding_function=self.embeddings)
+
+        with self.lock:
+            self.loaded[name] = store
+            self.loaded.move_to_end(name)
+            while len(self.loaded) > self.max_loaded:
+                self.loaded.popitem(last=False)
+        return store
+
+    def for_chat(self, user_id, chat_id):
+        return self.get(self.partition_for(user_id, chat_id))
+
+    def partitions(self):
+        names = []
+        for collection in self.client.list_collections():
+            names.append(collection if isinstance(collection, str) else collection.name)
+        return names
+
+    def drop(self, name):
+        with self.lock:
+            self.loaded.pop(name, None)
+        if name in self.partitions():
+            self.client.delete_collection(name)
+
+    def record_document(self, db, content_hash, name):
+        if db.get(DocumentPartition, (content_hash, name)):
+            return
+        try:
+            db.add(DocumentPartition(content_hash=content_hash, partition=name))
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+
+    def ensure_document(self, db, content_hash, name):
+        # Make sure the document's chunks are in the given partition. Returns
+        # False when no partition has them and they need to be embedded.
+        if db.get(DocumentPartition, (content_hash, name)):
+            return True
+
+        where = {"content_hash": content_hash}
+        sources = [row.partition for row in db.query(DocumentPartition).filter_by(content_hash=content_hash).all()]
+        # Documents embedded before partitioning live in the default collection
+        sources.append(self.default_store._collection.name)
+        existing = set(self.partitions())
+
+        for source in sources:
+            if source == name or source not in existing:
+                continue
+            if self.get(source)._collection.get(where=where, limit=1)["ids"]:
+                self.copy(source, name, where)
+                self.record_document(db, content_hash, name)
+                return True
+
+        target = self.get(name)
+        if target._collection.get(where=where, limit=1)["ids"]:
+            self.record_document(db, content_hash, name)
+            return True
+
+        return False
+
+    def copy(self, source, target, where):
+        source_collection = self.get(source)._collection
+        target_collection = self.get(target)._collection
+        offset = 0
+        while True:
+            batch = source_collection.get(
+                where=where,
+                include=["embeddings", "documents", "metadatas"],
+                limit=COPY_BATCH_SIZE,
+                offset=offset
+            )
+            if not batch["ids"]:
+                break
+            target_collection.upsert(
+                ids=batch["ids"],
+                embeddings=batch["embeddings"],
+                documents=batch["documents"],
+                metadatas=batch["metadatas"]
+            )
+            offset += len(batch["ids"])
+
+    def delete_document(self, db, content_hash):
+        names = {row.partition for row in db.query(DocumentPartition).filter_by(content_hash=content_hash).all()}
+        names.add(self.default_store._collection.name)
+        existing = set(self.partitions())
+        for name in names & existing:
+            self.get(name)._collection.delete(where={"content_hash": content_hash})
+        db.query(DocumentPartition).filter_by(content_hash=content_hash).delete(synchronize_session=False)
+        db.commit()
+
+    def release_partition(self, db, content_hash, name, existing=None):
+        # Drop a partition's copy of a document once no file routed to that
+        # partition uses it any more. Copies elsewhere are left alone.
+        # existing is the set of partitions when the caller already has it.
+        rows = db.query(File.chat_id, Chat.user_id)\
+            .join(Chat, Chat.chat_id == File.chat_id)\
+            .filter(File.content_hash == content_hash)\
+            .all()
+        if any(self.partition_for(user_id, chat_id) == name for chat_id, user_id in rows):
+            return False
+
+        if name in (existing if existing is not None else self.partitions()):
+            self.get(name)._collection.delete(where={"content_hash": content_hash})
+        db.query(DocumentPartition).filter_by(content_hash=content_hash, partition=name)\
+            .delete(synchronize_session=False)
+        db.commit()
+        return True
+
+    def delete_chat(self, user_id, chat_id):
+        # Chunks written before content hashing are tagged with their chat
+        name = self.partition_for(user_id, chat_id)
+        for partition in {name, self.default_store._collection.name}:
+            if partition in self.partitions():
+                self.get(partition)._collection.delete(where={"chat_id": chat_id})
+        if self.strategy == "chat":
+            self.drop(name)
+
+
+index_manager = IndexManager()
+
+
+def migrate(drop_source=False):
+    # Move an existing chroma_db into the configured partitions: every
+    # processed notes file gets its document copied into its chat's
+    # partition, along with any legacy chunks tagged with the chat id.
+    stats = {"documents": 0, "legacy_chats": 0, "missing": 0}
+    vectorstore = get_vectorstore()
+    default_name = vectorstore._collection.name
+    db = SessionLocal()
+    try:
+        chats = db.query(Chat).all()
+        for chat in chats:
+            name = index_manager.partition_for(chat.user_id, chat.chat_id)
+            if name == default_name:
+                continue
+
+            where = {"chat_id": chat.chat_id}
+            if vectorstore._collection.get(where=where, limit=1)["ids"]:
+                index_manager.copy(default_name, name, where)
+                stats["legacy_chats"] += 1
+
+            files = db.query(File).filter(
+                File.chat_id == chat.chat_id,
+                File.file_type == FileTypeEnum.notes,
+                File.status == FileStatusEnum.processed,
+                File.content_hash.isnot(None)
+            ).all()
+            for file in files:
+                if index_manager.ensure_document(db, file.content_hash, name):
+                    stats["documents"] += 1
+                else:
+                    stats["missing"] += 1
+
+        if drop_source and index_manager.strategy != "single":
+            index_manager.drop(default_name)
+    finally:
+        db.close()
+    return stats
+
+
+if __name__ == "__main__":
+    # python -m src.index_manager migrate [--drop-source]
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("usage: python -m src.index_manager migrate [--drop-source]")
+        sys.exit(1)
+    print(json.dumps(migrate(drop_source="--drop-source" in sys.argv), indent=2))
@@ -0,0 +1,276 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
+from config import Config
+from src.database import SessionLocal
+from src.models import IngestionJob, JobStatusEnum
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class IngestionQueue:
+    # Fixed-size worker pool backed by the ingestion_jobs table.
+    # Jobs are queued per user and served round robin so one user
+    # uploading a whole folder can't starve everyone else.
+    #
+    # Several worker processes can share the table. A job is claimed with a
+    # conditional update before it runs and holds a lease while it does
+    # (status running, renewed through updated_at); jobs whose lease ran
+    # out, because their process died, are picked up by the others.
+
+    def __init__(self, handler, on_failed=None, workers=Config.INGEST_WORKERS,
+                 max_pending=Config.INGEST_MAX_PENDING,
+                 max_pending_per_user=Config.INGEST_MAX_PENDING_PER_USER,
+                 lease_seconds=Config.INGEST_LEASE_SECONDS):
+        self.handler = handler
+        self.on_failed = on_failed
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_pending_per_user = max_pending_per_user
+        self.lease_seconds = lease_seconds
+
+        self.queues = OrderedDict()  # user_id -> deque of job ids
+        self.delayed = []  # heap of (run_at, job_id, user_id) waiting for a retry
+        self.pending = {}  # user_id -> number of unfinished jobs
+        self.known = set()  # job ids queued in this process
+        self.condition = threading.Condition()
+        self.threads = []
+
+    def start(self):
+        if self.threads:
+            return
+
+        self.resume()
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"ingest-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+        thread = threading.Thread(target=self._sweep, name="ingest-sweep", daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def claimable(self):
+        # Pending jobs that are due, and running jobs whose lease ran out.
+        # Retries are allowed to start a second early, the delay heap runs
+        # on a different clock.
+        now = datetime.utcnow()
+        return or_(
+            and_(IngestionJob.status == JobStatusEnum.pending,
+                 or_(IngestionJob.next_attempt_at.is_(None),
+                     IngestionJob.next_attempt_at <= now + timedelta(seconds=1))),
+            and_(IngestionJob.status == JobStatusEnum.running,
+                 IngestionJob.updated_at < now - timedelta(seconds=self.lease_seconds))
+        )
+
+    def resume(self):
+        # Queue unfinished jobs this process doesn't know about yet: left
+        # behind by a previous run, or by a worker process that died.
+        # Running jobs still under lease belong to a live process.
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            stale = now - timedelta(seconds=self.lease_seconds)
+            jobs = db.query(IngestionJob.job_id, IngestionJob.user_id, IngestionJob.next_attempt_at)\
+                .filter(or_(IngestionJob.status == JobStatusEnum.pending,
+                            and_(IngestionJob.status == JobStatusEnum.running, IngestionJob.updated_at < stale)))\
+                .order_by(IngestionJob.created_at.asc())\
+                .all()
+        finally:
+            db.close()
+
+        resumed = 0
+        with self.condition:
+            for job_id, user_id, next_attempt_at in jobs:
+                if job_id in self.known:
+                    continue
+                self.known.add(job_id)
+                self.pending[user_id] = self.pending.get(user_id, 0) + 1
+                if next_attempt_at and next_attempt_at > now:
+                    delay = (next_attempt_at - now).total_seconds()
+                    heapq.heappush(self.delayed, (time.monotonic() + delay, job_id, user_id))
+                else:
+                    self._push(user_id, job_id)
+                resumed += 1
+            self.condition.notify_all()
+
+        if resumed:
+            print(f"Resumed {resumed} ingestion jobs")
+
+    def _sweep(self):
+        while True:
+            time.sleep(self.lease_seconds / 2)
+            try:
+                self.resume()
+            except Exception as e:
+                print(f"Ingestion sweep failed: {e}")
+
+    def is_full(self, user_id=None):
+        # Counted in the database so the limits hold across worker processes
+        db = SessionLocal()
+        try:
+            unfinished = db.query(IngestionJob)\
+                .filter(IngestionJob.status.in_([JobStatusEnum.pending, JobStatusEnum.running]))
+            if unfinished.count() >= self.max_pending:
+                return True
+            return user_id is not None and \
+                unfinished.filter(IngestionJob.user_id == user_id).count() >= self.max_pending_per_user
+        finally:
+            db.close()
+
+    def depth(self):
+        with self.condition:
+            return sum(self.pending.values())
+
+    def submit(self, file_id, chat_id, user_id, file_path):
+        if self.is_full(user_id):
+            raise QueueFullError("Too many files are being processed, try again later")
+
+        db = SessionLocal()
+        try:
+            job = IngestionJob(
+                file_id=file_id,
+                chat_id=chat_id,
+                user_id=user_id,
+                file_path=file_path,
+                status=JobStatusEnum.pending
+            )
+            db.add(job)
+            db.commit()
+            job_id = job.job_id
+        finally:
+            db.close()
+
+        with self.condition:
+            self.known.add(job_id)
+            self.pending[user_id] = self.pending.get(user_id, 0) + 1
+            self._push(user_id, job_id)
+            self.condition.notify()
+
+        return job_id
+
+    def _push(self, user_id, job_id):
+        self.queues.setdefault(user_id, deque()).append(job_id)
+
+    def _next_job(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                while self.delayed and self.delayed[0][0] <= now:
+                    _, job_id, user_id = heapq.heappop(self.delayed)
+                    self._push(user_id, job_id)
+
+                if self.queues:
+                    # Take one job from the user at the front, then move
+                    # that user to the back of the line.
+                    user_id, jobs = self.queues.popitem(last=False)
+                    job_id = jobs.popleft()
+                    if jobs:
+                        self.queues[user_id] = jobs
+                    return job_id, user_id
+
+                timeout = self.delayed[0][0] - now if self.delayed else None
+                self.condition.wait(timeout)
+
+    def _finish(self, user_id, job_id):
+        with self.condition:
+            self.known.discard(job_id)
+            if user_id not in self.pending:
+                return
+            self.pending[user_id] -= 1
+            if self.pending[user_id] <= 0:
+                del self.pending[user_id]
+
+    def _retry(self, job_id, user_id, delay):
+        with self.condition:
+            heapq.heappush(self.delayed, (time.monotonic() + delay, job_id, user_id))
+            self.condition.notify()
+
+    def _worker(self):
+        while True:
+            job_id, user_id = self._next_job()
+            try:
+                self._run(job_id, user_id)
+            except Exception as e:
+                print(f"Ingestion worker error for job {job_id}: {e}")
+                self._finish(user_id, job_id)
+
+    def _renew(self, job_id, stop):
+        # Keep the lease on a running job until the handler returns
+        while not stop.wait(self.lease_seconds / 3):
+            db = SessionLocal()
+            try:
+                db.query(IngestionJob)\
+                    .filter(IngestionJob.job_id == job_id, IngestionJob.status == JobStatusEnum.running)\
+                    .update({IngestionJob.updated_at: datetime.utcnow()}, synchronize_session=False)
+                db.commit()
+            except Exception as e:
+                print(f"Renewing the lease on ingestion job {job_id} failed: {e}")
+            finally:
+                db.close()
+
+    def _run(self, job_id, user_id):
+        db = SessionLocal()
+        try:
+            claimed = db.query(IngestionJob)\
+                .filter(IngestionJob.job_id == job_id, self.claimable())\
+                .update({
+                    IngestionJob.status: JobStatusEnum.running,
+                    IngestionJob.attempts: IngestionJob.attempts + 1,
+                    IngestionJob.updated_at: datetime.utcnow(),
+                }, synchronize_session=False)
+            db.commit()
+            if not claimed:
+                # Finished, deleted or taken by another worker process
+                self._finish(user_id, job_id)
+                return
+            job = db.get(IngestionJob, job_id)
+            file_path, chat_id, file_id = job.file_path, job.chat_id, job.file_id
+            # Don't hold a transaction open while the file is processed
+            db.commit()
+
+            error = None
+            stop = threading.Event()
+            renewer = threading.Thread(target=self._renew, args=(job_id, stop), daemon=True)
+            renewer.start()
+            try:
+                ok = self.handler(file_path, chat_id, file_id)
+                if ok is False:
+                    error = "Processing failed"
+            except Exception as e:
+                error = str(e)
+            finally:
+                stop.set()
+                renewer.join()
+
+            if error is None:
+                job.status = JobStatusEnum.completed
+                job.last_error = None
+                db.commit()
+                self._finish(user_id, job_id)
+                return
+
+            print(f"Ingestion job {job_id} failed (attempt {job.attempts}): {error}")
+            job.last_error = error
+
+            if job.attempts >= Config.INGEST_MAX_ATTEMPTS:
+                job.status = JobStatusEnum.failed
+                db.commit()
+                self._finish(user_id, job_id)
+                if self.on_failed:
+                    self.on_failed(job.file_id)
+                return
+
+            delay = Config.INGEST_RETRY_BACKOFF * (2 ** (job.attempts - 1))
+            job.status = JobStatusEnum.pending
+            job.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+            db.commit()
+            self._retry(job_id, user_id, delay)
+        finally:
+            db.close()
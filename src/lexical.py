@@ -0,0 +1,124 @@
+import json
+import re
+import sqlite3
+import sys
+import threading
+from config import Config
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def match_query(text):
+    # User text can't go straight into MATCH, FTS5 has its own syntax. Quote
+    # every term and OR them together, with the whole phrase first so exact
+    # matches score highest.
+    terms = TOKEN_RE.findall(text.lower())
+    if not terms:
+        return None
+    parts = [f'"{term}"' for term in dict.fromkeys(terms)]
+    if len(terms) > 1:
+        parts.insert(0, '"' + " ".join(terms) + '"')
+    return " OR ".join(parts)
+
+
+class LexicalIndex:
+    # BM25 over chunk text using SQLite FTS5. Chunks are keyed by content
+    # hash and chunk id exactly like in the vector store, so a document
+    # shared by several chats is indexed once and searches are scoped by
+    # the chat's content hashes.
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS lexical_chunks (
+                id INTEGER PRIMARY KEY,
+                chunk_id TEXT UNIQUE NOT NULL,
+                content_hash TEXT NOT NULL,
+                text TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS lexical_chunks_content_hash ON lexical_chunks (content_hash);
+            CREATE VIRTUAL TABLE IF NOT EXISTS lexical_fts USING fts5(
+                text, content='lexical_chunks', content_rowid='id', tokenize='porter unicode61'
+            );
+            CREATE TRIGGER IF NOT EXISTS lexical_chunks_insert AFTER INSERT ON lexical_chunks BEGIN
+                INSERT INTO lexical_fts (rowid, text) VALUES (new.id, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS lexical_chunks_delete AFTER DELETE ON lexical_chunks BEGIN
+                INSERT INTO lexical_fts (lexical_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            END;
+        """)
+        self.conn.commit()
+
+    def add(self, chunks):
+        # chunks: (chunk_id, content_hash, text). Chunk ids are derived from
+        # the content, so re-adding one after a retry is a no-op.
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO lexical_chunks (chunk_id, content_hash, text) VALUES (?, ?, ?) "
+                "ON CONFLICT (chunk_id) DO NOTHING",
+                chunks
+            )
+            self.conn.commit()
+
+    def delete(self, content_hash):
+        with self.lock:
+            self.conn.execute("DELETE FROM lexical_chunks WHERE content_hash = ?", (content_hash,))
+            self.conn.commit()
+
+    def hashes(self):
+        with self.lock:
+            return {row[0] for row in self.conn.execute("SELECT DISTINCT content_hash FROM lexical_chunks")}
+
+    def search(self, text, content_hashes, k):
+        # Best first list of (chunk_id, content_hash, text)
+        query = match_query(text)
+        if not query or not content_hashes:
+            return []
+
+        placeholders = ", ".join("?" for _ in content_hashes)
+        with self.lock:
+            return self.conn.execute(
+                "SELECT c.chunk_id, c.content_hash, c.text FROM lexical_fts "
+                "JOIN lexical_chunks c ON c.id = lexical_fts.rowid "
+                f"WHERE lexical_fts MATCH ? AND c.content_hash IN ({placeholders}) "
+                "ORDER BY bm25(lexical_fts) LIMIT ?",
+                (query, *content_hashes, k)
+            ).fetchall()
+
+
+lexical_index = LexicalIndex(Config.LEXICAL_INDEX_PATH)
+
+
+def backfill(batch_size=500):
+    # Index chunks that were embedded before the lexical index existed
+    from src.index_manager import index_manager
+
+    indexed = lexical_index.hashes()
+    added = 0
+    for name in index_manager.partitions():
+        collection = index_manager.get(name)._collection
+        offset = 0
+        while True:
+            batch = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+            if not batch["ids"]:
+                break
+            chunks = [
+                (chunk_id, metadata["content_hash"], text)
+                for chunk_id, text, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"])
+                if metadata and metadata.get("content_hash") and metadata["content_hash"] not in indexed
+            ]
+            if chunks:
+                lexical_index.add(chunks)
+                added += len(chunks)
+            offset += len(batch["ids"])
+    return {"chunks_added": added}
+
+
+if __name__ == "__main__":
+    # python -m src.lexical backfill
+    if len(sys.argv) < 2 or sys.argv[1] != "backfill":
+        print("usage: python -m src.lexical backfill")
+        sys.exit(1)
+    print(json.dumps(backfill(), indent=2))
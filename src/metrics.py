@@ -0,0 +1,278 @@
+import json
+import logging
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from config import Config
+
+# Prometheus text format metrics, kept per process, and structured
+# request logs. Wrap a stage in `with span("chat.search"):` to get its
+# latency into rune_stage_duration_seconds and into the request log line.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+REGISTRY = []
+
+request_id_var = ContextVar("request_id", default=None)
+stages_var = ContextVar("stages", default=None)
+
+logger = logging.getLogger("rune")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in values.items()]
+
+
+class Gauge(Metric):
+    # Either set directly or read from a callback at scrape time, one
+    # callback per label set. A callback returning None is left out.
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=(), callback=None):
+        super().__init__(name, documentation, labels)
+        self.values = {}
+        self.callbacks = {}  # label values -> callback
+        if callback is not None:
+            self.set_callback(callback)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_callback(self, callback, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.callbacks[key] = callback
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+            callbacks = dict(self.callbacks)
+
+        for key, callback in callbacks.items():
+            try:
+                value = callback()
+            except Exception as e:
+                print(f"Gauge {self.name} failed: {e}")
+                value = None
+            if value is None:
+                values.pop(key, None)
+            else:
+                values[key] = value
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self.values = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self.lock:
+            values = {key: list(series) for key, series in self.values.items()}
+
+        lines = []
+        for key, series in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _labels(self.label_names, key, [("le", _number(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+
+def render():
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+STAGE_SECONDS = Histogram("rune_stage_duration_seconds", "Time spent in each stage of a request or job.", ["stage"])
+STAGE_ERRORS = Counter("rune_stage_errors_total", "Stages that raised an exception.", ["stage"])
+HTTP_SECONDS = Histogram("rune_http_request_duration_seconds", "Time until the response (or its first byte when streamed).",
+                         ["method", "endpoint", "status"])
+LLM_FIRST_TOKEN_SECONDS = Histogram("rune_llm_time_to_first_token_seconds", "Time from prompt to the first answer token.",
+                                    ["route"])
+LLM_TOKENS = Counter("rune_llm_tokens_total", "Answer chunks streamed from the LLM.", ["route"])
+ACTIVE_STREAMS = Gauge("rune_active_streams", "Chat answers currently streaming.", ["route"])
+INGEST_QUEUE_DEPTH = Gauge("rune_ingest_queue_depth", "Files waiting or being processed by the ingestion workers.")
+INGEST_FILES = Counter("rune_ingest_files_total", "Files finished by the ingestion workers.", ["result"])
+GENERATION_REQUESTS = Counter("rune_generation_requests_total", "MCQ and flashcard requests.", ["kind", "cached"])
+CACHE_HITS = Gauge("rune_cache_hits", "Lookups answered by a cache since the process started.", ["cache"])
+CACHE_MISSES = Gauge("rune_cache_misses", "Lookups a cache could not answer since the process started.", ["cache"])
+CACHE_ENTRIES = Gauge("rune_cache_entries", "Entries a cache holds in memory.", ["cache"])
+
+
+def watch_cache(name, stats, entries="memory_items"):
+    # Read a cache's stats() at scrape time. stats may return None while
+    # the cache hasn't been created in this process.
+    def read(stat):
+        def value():
+            current = stats()
+            return current[stat] if current else None
+        return value
+
+    CACHE_HITS.set_callback(read("hits"), cache=name)
+    CACHE_MISSES.set_callback(read("misses"), cache=name)
+    CACHE_ENTRIES.set_callback(read(entries), cache=name)
+
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        stages = stages_var.get()
+        if stages is not None:
+            stages[stage] = round(stages.get(stage, 0) + elapsed * 1000, 2)
+
+
+def log_event(event, **fields):
+    logger.info(json.dumps({
+        "ts": round(time.time(), 3),
+        "event": event,
+        "request_id": request_id_var.get(),
+        **fields,
+    }, default=str))
+
+
+def setup_logging():
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(Config.LOG_LEVEL)
+    logger.propagate = False
+
+
+def init_app(app):
+    # Request IDs, per request logs with stage timings, and the /metrics route
+    from flask import Response, g, request
+
+    setup_logging()
+
+    @app.before_request
+    def start_request():
+        g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+        g.request_start = time.perf_counter()
+        g.stages = {}
+        g.context_tokens = (request_id_var.set(g.request_id), stages_var.set(g.stages))
+
+    @app.after_request
+    def finish_request(response):
+        if "request_start" not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_start
+        endpoint = request.endpoint or "unmatched"
+        response.headers["X-Request-ID"] = g.request_id
+        if endpoint != "metrics":
+            HTTP_SECONDS.observe(elapsed, method=request.method, endpoint=endpoint, status=str(response.status_code))
+            log_event(
+                "request",
+                method=request.method,
+                path=request.path,
+                endpoint=endpoint,
+                status=response.status_code,
+                duration_ms=round(elapsed * 1000, 2),
+                streamed=response.is_streamed,
+                stages=g.stages,
+            )
+        return response
+
+    @app.teardown_request
+    def reset_request(exception=None):
+        tokens = g.pop("context_tokens", None)
+        if tokens:
+            request_id_var.reset(tokens[0])
+            stages_var.reset(tokens[1])
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, Boolean, Enum
+from sqlalchemy import Column, String, DateTime, ForeignKey, Boolean, Enum, Integer, Float, Text, Index, LargeBinary
 from sqlalchemy.orm import relationship
 import enum
 from src.database import Base
@@ -12,6 +12,13 @@ class FileTypeEnum(enum.Enum):
 class FileStatusEnum(enum.Enum):
     pending = "pending"
     processed = "processed"
+    failed = "failed"
+
+class JobStatusEnum(enum.Enum):
+    pending = "pending"
+    running = "running"
+    completed = "completed"
+    failed = "failed"
 
 def generate_uuid():
     return str(uuid.uuid4())
@@ -30,12 +37,18 @@ class User(Base):
 
 class Chat(Base):
     __tablename__ = "chats"
+    __table_args__ = (
+        Index("ix_chats_user_id_created_at", "user_id", "created_at"),
+    )
 
     chat_id = Column(String, primary_key=True, default=generate_uuid)
     title = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
     user_id = Column(String, ForeignKey("users.user_id"))
     bookmarked = Column(Boolean, default=False)
+    history_summary = Column(Text, nullable=True)
+    summarized_until = Column(DateTime, nullable=True)
+    corpus_version = Column(Integer, default=0)  # bumped whenever the chat's files change
 
     user = relationship("User", back_populates="chats")
     messages = relationship("ChatMessage", back_populates="chat")
@@ -44,6 +57,9 @@ class Chat(Base):
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        Index("ix_chat_messages_chat_id_timestamp", "chat_id", "timestamp"),
+    )
 
     message_id = Column(String, primary_key=True, default=generate_uuid)
     chat_id = Column(String, ForeignKey("chats.chat_id"))
@@ -55,6 +71,9 @@ class ChatMessage(Base):
 
 class File(Base):
     __tablename__ = "files"
+    __table_args__ = (
+        Index("ix_files_chat_id_file_type", "chat_id", "file_type"),
+    )
 
     file_id = Column(String, primary_key=True, default=generate_uuid)
     chat_id = Column(String, ForeignKey("chats.chat_id"))
@@ -63,6 +82,124 @@ class File(Base):
     file_type = Column(Enum(FileTypeEnum), nullable=False)
     status = Column(Enum(FileStatusEnum), default=FileStatusEnum.pending)
     content = Column(String, nullable=True)
+    content_hash = Column(String, ForeignKey("documents.content_hash"), nullable=True, index=True)
+
+
+    chat = relationship("Chat", back_populates="files")
+    document = relationship("Document", back_populates="files")
+
+
+class Document(Base):
+    # One row per unique upload (SHA-256 of the bytes). Extracted text and
+    # chunk embeddings are produced once and shared by every File with the
+    # same content.
+    __tablename__ = "documents"
+
+    content_hash = Column(String, primary_key=True)
+    text = Column(Text, nullable=True)
+    chunk_count = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    processed_at = Column(DateTime, nullable=True)
+
+    files = relationship("File", back_populates="document")
+    topics = relationship("SyllabusTopic", back_populates="document", order_by="SyllabusTopic.position")
+
+
+class DocumentPartition(Base):
+    # Vector store partitions (Chroma collections) holding a document's chunks
+    __tablename__ = "document_partitions"
+
+    content_hash = Column(String, ForeignKey("documents.content_hash"), primary_key=True)
+    partition = Column(String, primary_key=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class SyllabusTopic(Base):
+    # A syllabus split into topics at ingest, with one embedding per topic
+    # so each chat turn only includes the topics relevant to the question.
+    __tablename__ = "syllabus_topics"
+
+    topic_id = Column(String, primary_key=True, default=generate_uuid)
+    content_hash = Column(String, ForeignKey("documents.content_hash"), index=True)
+    position = Column(Integer, nullable=False)
+    title = Column(String)
+    content = Column(Text)
+    embedding = Column(LargeBinary, nullable=True)
+
+    document = relationship("Document", back_populates="topics")
+
+
+class QuestionBank(Base):
+    # MCQs and flashcards generated ahead of time for a notes document,
+    # grouped by topic. Built in the background after ingestion.
+    __tablename__ = "question_banks"
+
+    content_hash = Column(String, ForeignKey("documents.content_hash"), primary_key=True)
+    status = Column(Enum(JobStatusEnum), default=JobStatusEnum.pending, index=True)
+    topic_count = Column(Integer, default=0)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    topics = relationship("BankTopic", back_populates="bank", order_by="BankTopic.position")
+
+
+class BankTopic(Base):
+    # A run of consecutive chunks, embedded as the mean of their vectors
+    __tablename__ = "bank_topics"
+
+    topic_id = Column(String, primary_key=True, default=generate_uuid)
+    content_hash = Column(String, ForeignKey("question_banks.content_hash"), index=True)
+    position = Column(Integer, nullable=False)
+    title = Column(String)
+    embedding = Column(LargeBinary, nullable=False)
+
+    bank = relationship("QuestionBank", back_populates="topics")
+    items = relationship("BankItem", back_populates="topic")
+
+
+class BankItem(Base):
+    # One generated question, stored as the JSON object the LLM returned
+    __tablename__ = "bank_items"
+    __table_args__ = (
+        Index("ix_bank_items_topic_id_kind", "topic_id", "kind"),
+    )
+
+    item_id = Column(String, primary_key=True, default=generate_uuid)
+    topic_id = Column(String, ForeignKey("bank_topics.topic_id"))
+    kind = Column(String, nullable=False)  # "mcq" or "flashcard"
+    content = Column(Text, nullable=False)
+
+    topic = relationship("BankTopic", back_populates="items")
+
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    job_id = Column(String, primary_key=True, default=generate_uuid)
+    file_id = Column(String, ForeignKey("files.file_id"))
+    chat_id = Column(String, ForeignKey("chats.chat_id"))
+    user_id = Column(String, ForeignKey("users.user_id"), index=True)
+    file_path = Column(String, nullable=False)
+    status = Column(Enum(JobStatusEnum), default=JobStatusEnum.pending, index=True)
+    attempts = Column(Integer, default=0)
+    last_error = Column(String, nullable=True)
+    next_attempt_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    file = relationship("File")
+
 
+class UploadProgress(Base):
+    # Progress of uploads being processed, readable by every worker process.
+    # Not tied to files so an entry can outlive a deleted file until evicted.
+    __tablename__ = "upload_progress"
 
-    chat = relationship("Chat", back_populates="files")
\ No newline at end of file
+    file_id = Column(String, primary_key=True)
+    user_id = Column(String, nullable=False)
+    file_name = Column(String)
+    file_type = Column(String)
+    progress = Column(Float, default=0)
+    status = Column(String, default="pending")
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)
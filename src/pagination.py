@@ -0,0 +1,83 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+from config import Config
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def encode_cursor(value, row_id):
+    if isinstance(value, datetime):
+        payload = {"t": value.isoformat(), "id": row_id}
+    else:
+        payload = {"v": value, "id": row_id}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        value = datetime.fromisoformat(payload["t"]) if "t" in payload else payload["v"]
+        return value, payload["id"]
+    except Exception:
+        raise PaginationError("Invalid cursor")
+
+
+def parse_limit(args):
+    try:
+        limit = int(args.get("limit", Config.PAGE_DEFAULT_LIMIT))
+    except (TypeError, ValueError):
+        raise PaginationError("Invalid limit")
+    if limit < 1:
+        raise PaginationError("Invalid limit")
+    return min(limit, Config.PAGE_MAX_LIMIT)
+
+
+def paginate(query, sort_column, id_column, args, tail=False):
+    # Keyset pagination over (sort_column, id_column). Rows always come back
+    # in ascending order. `after` reads forward from a cursor, `before` reads
+    # backward; without a cursor we start from the end when tail is set
+    # (e.g. newest messages) or from the beginning otherwise.
+    limit = parse_limit(args)
+    before = args.get("before")
+    after = args.get("after")
+
+    if after:
+        value, row_id = decode_cursor(after)
+        query = query.filter(or_(sort_column > value, and_(sort_column == value, id_column > row_id)))
+        forward = True
+    elif before:
+        value, row_id = decode_cursor(before)
+        query = query.filter(or_(sort_column < value, and_(sort_column == value, id_column < row_id)))
+        forward = False
+    else:
+        forward = not tail
+
+    if forward:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+    else:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not forward:
+        rows.reverse()
+
+    page = {"rows": rows, "has_more": has_more, "before": None, "after": None}
+    if rows:
+        page["before"] = encode_cursor(getattr(rows[0], sort_column.key), getattr(rows[0], id_column.key))
+        page["after"] = encode_cursor(getattr(rows[-1], sort_column.key), getattr(rows[-1], id_column.key))
+    return page
+
+
+def page_headers(page):
+    headers = {"X-Has-More": "true" if page["has_more"] else "false"}
+    if page["before"]:
+        headers["X-Cursor-Before"] = page["before"]
+    if page["after"]:
+        headers["X-Cursor-After"] = page["after"]
+    return headers
@@ -0,0 +1,59 @@
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pypdf import PdfReader
+from config import Config
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawned, not forked: this runs from an ingestion thread of a
+            # multi-threaded server holding open Chroma and SQLite handles
+            _executor = ProcessPoolExecutor(
+                max_workers=Config.PDF_EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def extract_page_range(file_path, start, end):
+    # Runs in a worker process, so it opens its own reader
+    reader = PdfReader(file_path)
+    return [reader.pages[i].extract_text() for i in range(start, end)]
+
+
+def iter_pdf_pages(file_path):
+    # Yield (page_number, text) in page order. Large PDFs are cut into page
+    # ranges extracted in a process pool; only a few ranges are in flight at
+    # once so memory stays bounded.
+    reader = PdfReader(file_path)
+    total = len(reader.pages)
+
+    if total < Config.PDF_PARALLEL_MIN_PAGES or Config.PDF_EXTRACT_WORKERS <= 1:
+        for i in range(total):
+            yield i, reader.pages[i].extract_text()
+        return
+
+    size = Config.PDF_PAGE_RANGE_SIZE
+    ranges = deque((start, min(start + size, total)) for start in range(0, total, size))
+    executor = get_executor()
+    in_flight = deque()
+
+    try:
+        while ranges or in_flight:
+            while ranges and len(in_flight) < Config.PDF_EXTRACT_WORKERS * 2:
+                start, end = ranges.popleft()
+                in_flight.append((start, executor.submit(extract_page_range, file_path, start, end)))
+
+            start, future = in_flight.popleft()
+            for offset, text in enumerate(future.result()):
+                yield start + offset, text
+    finally:
+        for _, future in in_flight:
+            future.cancel()
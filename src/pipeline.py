@@ -0,0 +1,210 @@
+import queue
+import threading
+import time
+from config import Config
+from src.rag_chain import count_pages, stream_documents
+from src.lexical import lexical_index
+from src.metrics import span
+
+# Stage sentinels
+DONE = object()
+
+
+class PipelineError(Exception):
+    pass
+
+
+class BatchSizer:
+    # Picks the number of chunks per embedding call from the calls timed so
+    # far. Batches grow while chunks/second keeps up with the best rate seen
+    # and calls stay under the target latency; a slow call halves the size
+    # and a drop in throughput backs it off a little. The best rate decays
+    # so the size follows the embedding server as its load changes.
+
+    def __init__(self, initial=Config.INGEST_BATCH_SIZE, minimum=Config.INGEST_MIN_BATCH_SIZE,
+                 maximum=Config.INGEST_MAX_BATCH_SIZE, target_seconds=Config.INGEST_BATCH_TARGET_SECONDS,
+                 decay=0.95):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.decay = decay
+        self.size = max(minimum, min(maximum, initial))
+        self.best_rate = 0.0
+        self.lock = threading.Lock()
+
+    def next_size(self):
+        with self.lock:
+            return self.size
+
+    def record(self, count, seconds):
+        rate = count / max(seconds, 1e-6)
+        with self.lock:
+            if seconds > self.target_seconds:
+                size = self.size // 2
+            elif rate >= self.best_rate * 0.9:
+                size = self.size + max(1, self.size // 2)
+            else:
+                size = self.size - max(1, self.size // 4)
+            self.size = max(self.minimum, min(self.maximum, size))
+            self.best_rate = max(self.best_rate * self.decay, rate)
+
+
+# Shared by every ingestion worker in the process: one view of how the
+# embedding server is doing, and one ceiling on the calls made to it
+batch_sizer = BatchSizer()
+embedding_slots = threading.BoundedSemaphore(Config.EMBEDDING_MAX_IN_FLIGHT)
+
+
+def _put(q, item, stop):
+    # Block while the next stage is busy, but give up once the pipeline stops
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return DONE
+
+
+def _parse_stage(file_path, content_hash, sizer, out, stop, errors):
+    # page stream -> splitter -> numbered batches, each sized by the sizer
+    # at the time it is cut
+    try:
+        batch = []
+        seq = 0
+        chunk_index = 0
+        pages_done = 0
+        for splits in stream_documents(file_path):
+            for split in splits:
+                split.metadata['content_hash'] = content_hash
+                split.metadata['chunk_index'] = chunk_index
+                batch.append((f"{content_hash}:{chunk_index}", split))
+                chunk_index += 1
+                if len(batch) >= sizer.next_size():
+                    if not _put(out, (seq, batch, pages_done), stop):
+                        return
+                    seq += 1
+                    batch = []
+            pages_done += 1
+
+        if batch:
+            _put(out, (seq, batch, pages_done), stop)
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        _put(out, DONE, stop)
+
+
+def _embed_stage(embeddings, sizer, slots, source, out, stop, errors):
+    # One of several embedders sharing the source queue. Only the time spent
+    # holding a slot is measured, so waiting for other workers doesn't count
+    # against the batch size.
+    try:
+        while True:
+            item = _get(source, stop)
+            if item is DONE:
+                # Pass it on to the next embedder
+                _put(source, DONE, stop)
+                return
+            seq, batch, pages_done = item
+            texts = [split.page_content for _, split in batch]
+            with slots:
+                start = time.perf_counter()
+                with span("ingest.embed_batch"):
+                    vectors = embeddings.embed_documents(texts)
+                sizer.record(len(batch), time.perf_counter() - start)
+            if not _put(out, (seq, batch, vectors, pages_done), stop):
+                return
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        _put(out, DONE, stop)
+
+
+def ingest_document(vectorstore, file_path, content_hash, on_progress=None, sizer=None, slots=None,
+                    workers=Config.INGEST_EMBED_WORKERS, queue_size=Config.INGEST_QUEUE_SIZE):
+    # Parse, embed and write run as separate stages connected by bounded
+    # queues, so at most a few batches are held in memory at any time no
+    # matter how large the document is. Several embedders keep batches in
+    # flight while earlier ones are written. Returns the number of chunks
+    # written.
+    sizer = sizer or batch_sizer
+    slots = slots or embedding_slots
+    total_pages = count_pages(file_path)
+
+    batches = queue.Queue(maxsize=max(queue_size, workers))
+    embedded = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    parser = threading.Thread(
+        target=_parse_stage,
+        args=(file_path, content_hash, sizer, batches, stop, errors),
+        daemon=True
+    )
+    embedders = [
+        threading.Thread(
+            target=_embed_stage,
+            args=(vectorstore.embeddings, sizer, slots, batches, embedded, stop, errors),
+            daemon=True
+        )
+        for _ in range(workers)
+    ]
+    parser.start()
+    for embedder in embedders:
+        embedder.start()
+
+    chunk_count = 0
+    finished = 0
+    # Batches can finish out of order; progress only counts the pages
+    # before the first batch that hasn't been written yet
+    written = {}
+    next_seq = 0
+    pages_written = 0
+    try:
+        while finished < workers:
+            item = _get(embedded, stop)
+            if item is DONE:
+                if stop.is_set():
+                    break
+                finished += 1
+                continue
+            seq, batch, vectors, pages_done = item
+            vectorstore._collection.upsert(
+                ids=[chunk_id for chunk_id, _ in batch],
+                embeddings=vectors,
+                documents=[split.page_content for _, split in batch],
+                metadatas=[split.metadata for _, split in batch]
+            )
+            lexical_index.add([(chunk_id, content_hash, split.page_content) for chunk_id, split in batch])
+            chunk_count += len(batch)
+
+            written[seq] = pages_done
+            while next_seq in written:
+                pages_written = written.pop(next_seq)
+                next_seq += 1
+            if on_progress and total_pages:
+                on_progress(min(100, pages_written / total_pages * 100))
+    except Exception as e:
+        errors.append(e)
+    finally:
+        stop.set()
+        parser.join()
+        for embedder in embedders:
+            embedder.join()
+
+    if errors:
+        raise PipelineError(str(errors[0])) from errors[0]
+
+    return chunk_count
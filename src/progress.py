@@ -0,0 +1,215 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from config import Config
+from src.database import SessionLocal
+from src.models import UploadProgress
+
+FINISHED = ("completed", "failed")
+
+
+def snapshot(entry):
+    # What a client has already seen of an entry
+    if entry is None:
+        return None
+    return entry["status"], entry["progress"]
+
+
+class ProgressStore(ABC):
+    # Upload progress entries are dicts with file_id, file_name, user_id,
+    # file_type, progress and status. Finished entries are evicted after
+    # PROGRESS_FINISHED_TTL, forgotten ones after PROGRESS_STALE_TTL.
+
+    def __init__(self):
+        self.last_evicted = 0.0
+        self.evict_lock = threading.Lock()
+
+    @abstractmethod
+    def add(self, file_id, entry):
+        pass
+
+    @abstractmethod
+    def update(self, file_id, **fields):
+        pass
+
+    @abstractmethod
+    def get(self, file_id):
+        pass
+
+    @abstractmethod
+    def evict(self, now):
+        pass
+
+    def maybe_evict(self):
+        with self.evict_lock:
+            now = time.time()
+            if now - self.last_evicted < Config.PROGRESS_EVICT_INTERVAL:
+                return
+            self.last_evicted = now
+        try:
+            self.evict(now)
+        except Exception as e:
+            print(f"Progress eviction failed: {e}")
+
+    def wait(self, file_id, seen, timeout):
+        # Block until the entry differs from what the client has seen, it
+        # finishes or the timeout passes. Returns the current entry. Polls
+        # the store, so every waiting client holds a worker thread.
+        deadline = time.monotonic() + timeout
+        while True:
+            entry = self.get(file_id)
+            if entry is None or snapshot(entry) != seen or entry["status"] in FINISHED:
+                return entry
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return entry
+            time.sleep(min(Config.PROGRESS_POLL_INTERVAL, remaining))
+
+
+class MemoryProgressStore(ProgressStore):
+    # Only visible to the process that owns it. Fine for a single worker.
+
+    def __init__(self):
+        super().__init__()
+        self.entries = {}
+        self.changed = threading.Condition()
+
+    def add(self, file_id, entry):
+        with self.changed:
+            self.entries[file_id] = {**entry, "updated_at": time.time()}
+            self.changed.notify_all()
+        self.maybe_evict()
+
+    def update(self, file_id, **fields):
+        with self.changed:
+            entry = self.entries.get(file_id)
+            if entry is None:
+                return
+            entry.update(fields, updated_at=time.time())
+            self.changed.notify_all()
+
+    def get(self, file_id):
+        with self.changed:
+            entry = self.entries.get(file_id)
+            return dict(entry) if entry else None
+
+    def evict(self, now):
+        with self.changed:
+            for file_id, entry in list(self.entries.items()):
+                age = now - entry["updated_at"]
+                if age > Config.PROGRESS_STALE_TTL or (entry["status"] in FINISHED and age > Config.PROGRESS_FINISHED_TTL):
+                    del self.entries[file_id]
+
+    def wait(self, file_id, seen, timeout):
+        # Woken by updates instead of polling
+        deadline = time.monotonic() + timeout
+        with self.changed:
+            while True:
+                entry = self.entries.get(file_id)
+                if entry is None or snapshot(entry) != seen or entry["status"] in FINISHED:
+                    return dict(entry) if entry else None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return dict(entry)
+                self.changed.wait(remaining)
+
+
+class DatabaseProgressStore(ProgressStore):
+    # Kept in the app database so every worker process sees the same state.
+    # Progress writes are skipped until the value moved by at least a
+    # percent, ingestion reports after every batch.
+
+    MIN_STEP = 1.0
+
+    def __init__(self):
+        super().__init__()
+        self.written = {}  # file_id -> last progress written by this process
+        self.lock = threading.Lock()
+
+    def add(self, file_id, entry):
+        # Rows are expired on commit and detached on close, so nothing is
+        # read back from them afterwards
+        progress = entry.get("progress") or 0
+        db = SessionLocal()
+        try:
+            row = db.get(UploadProgress, file_id) or UploadProgress(file_id=file_id)
+            row.user_id = entry["user_id"]
+            row.file_name = entry.get("file_name")
+            row.file_type = entry.get("file_type")
+            row.progress = progress
+            row.status = entry.get("status") or "pending"
+            row.updated_at = datetime.utcnow()
+            db.add(row)
+            db.commit()
+        except IntegrityError:
+            # Added concurrently by another process, keep theirs
+            db.rollback()
+        finally:
+            db.close()
+        with self.lock:
+            self.written[file_id] = progress
+        self.maybe_evict()
+
+    def update(self, file_id, **fields):
+        if set(fields) == {"progress"}:
+            with self.lock:
+                last = self.written.get(file_id)
+                if last is not None and abs(fields["progress"] - last) < self.MIN_STEP and fields["progress"] < 100:
+                    return
+                self.written[file_id] = fields["progress"]
+        elif fields.get("status") in FINISHED:
+            with self.lock:
+                self.written.pop(file_id, None)
+
+        db = SessionLocal()
+        try:
+            db.query(UploadProgress).filter(UploadProgress.file_id == file_id)\
+                .update({**fields, "updated_at": datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def get(self, file_id):
+        db = SessionLocal()
+        try:
+            row = db.get(UploadProgress, file_id)
+            if row is None:
+                return None
+            return {
+                "file_id": row.file_id,
+                "file_name": row.file_name,
+                "user_id": row.user_id,
+                "file_type": row.file_type,
+                "progress": row.progress,
+                "status": row.status,
+            }
+        finally:
+            db.close()
+
+    def evict(self, now):
+        now = datetime.utcfromtimestamp(now)
+        db = SessionLocal()
+        try:
+            db.query(UploadProgress).filter(or_(
+                UploadProgress.updated_at < now - timedelta(seconds=Config.PROGRESS_STALE_TTL),
+                UploadProgress.status.in_(FINISHED)
+                & (UploadProgress.updated_at < now - timedelta(seconds=Config.PROGRESS_FINISHED_TTL))
+            )).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+
+BACKENDS = {
+    "memory": MemoryProgressStore,
+    "database": DatabaseProgressStore,
+}
+
+
+def create_progress_store(backend=Config.PROGRESS_BACKEND):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown progress backend: {backend}")
+    return BACKENDS[backend]()
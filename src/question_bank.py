@@ -0,0 +1,324 @@
+import json
+import queue
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import reduce
+import numpy as np
+from config import Config
+from src.context_packer import join_overlapping
+from src.database import SessionLocal
+from src.index_manager import index_manager
+from src.metrics import span, log_event
+from sqlalchemy import and_, or_
+from src.models import BankItem, BankTopic, DocumentPartition, JobStatusEnum, QuestionBank
+from src.rag_chain import get_embeddings, get_llm
+
+# Question banks: after a notes file is ingested its chunks are grouped
+# into topics and the MCQ / flashcard prompts are run once per topic in the
+# background. Keyword requests whose keywords all land on banked topics are
+# then answered by sampling from the bank instead of calling the LLM.
+
+FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def parse_items(text):
+    # The prompts ask for a JSON list, which models tend to wrap in a code
+    # fence and sometimes in an object ({"questions": [...]})
+    try:
+        data = json.loads(FENCE_RE.sub("", text.strip()))
+    except ValueError:
+        return []
+    if isinstance(data, dict):
+        data = next((value for value in data.values() if isinstance(value, list)), [])
+    if not isinstance(data, list):
+        return []
+    return [item for item in data if isinstance(item, dict)]
+
+
+def load_chunks(db, content_hash):
+    # The document's chunks in order, with their vectors, from any
+    # partition holding them
+    names = [row.partition for row in db.query(DocumentPartition).filter_by(content_hash=content_hash).all()]
+    names.append(index_manager.default_store._collection.name)
+    existing = set(index_manager.partitions())
+
+    for name in names:
+        if name not in existing:
+            continue
+        result = index_manager.get(name)._collection.get(
+            where={"content_hash": content_hash},
+            include=["documents", "metadatas", "embeddings"]
+        )
+        if result["ids"]:
+            rows = sorted(zip(result["metadatas"], result["documents"], result["embeddings"]),
+                          key=lambda row: row[0].get("chunk_index", 0))
+            return [(text, vector) for _, text, vector in rows]
+    return []
+
+
+def group_topics(chunks, per_topic=Config.QUESTION_BANK_CHUNKS_PER_TOPIC, max_topics=Config.QUESTION_BANK_MAX_TOPICS):
+    # Runs of consecutive chunks. Past max_topics, evenly spaced runs are
+    # kept so the LLM cost per document stays bounded; keywords about the
+    # parts left out fall back to live generation.
+    groups = [chunks[start:start + per_topic] for start in range(0, len(chunks), per_topic)]
+    if len(groups) > max_topics:
+        step = len(groups) / max_topics
+        groups = [groups[int(i * step)] for i in range(max_topics)]
+
+    topics = []
+    for group in groups:
+        text = reduce(join_overlapping, [text for text, _ in group])
+        vector = np.mean(np.array([vector for _, vector in group], dtype=np.float32), axis=0)
+        vector /= np.linalg.norm(vector) + 1e-10
+        title = next((line.strip() for line in text.splitlines() if line.strip()), "")[:200]
+        topics.append((title, text, vector))
+    return topics
+
+
+class BankBuilder:
+    # A single low priority thread building one bank at a time. It holds
+    # off while uploads are being processed and pauses between LLM calls,
+    # so live chat and quiz requests get the model first.
+    #
+    # A build holds a lease on its bank row (status running, renewed through
+    # updated_at), so with several worker processes only a build whose
+    # process died is ever taken over.
+
+    def __init__(self, idle_seconds=Config.QUESTION_BANK_IDLE_SECONDS, lease_seconds=Config.QUESTION_BANK_LEASE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self.lease_seconds = lease_seconds
+        self.kinds = {}  # kind -> prompt taking {context}
+        self.is_busy = lambda: False
+        self.queue = queue.Queue()
+        self.queued = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def register_kind(self, kind, prompt):
+        self.kinds[kind] = prompt
+
+    def set_busy_check(self, check):
+        self.is_busy = check
+
+    def start(self):
+        if self.thread:
+            return
+        self.resume()
+        self.thread = threading.Thread(target=self._worker, name="question-bank", daemon=True)
+        self.thread.start()
+
+    def claimable(self):
+        # Pending banks, and running ones whose lease ran out
+        stale = datetime.utcnow() - timedelta(seconds=self.lease_seconds)
+        return or_(
+            QuestionBank.status == JobStatusEnum.pending,
+            and_(QuestionBank.status == JobStatusEnum.running, QuestionBank.updated_at < stale)
+        )
+
+    def resume(self):
+        # Banks left unfinished by a previous run are built again from
+        # scratch. Builds still held by a live process are left alone.
+        db = SessionLocal()
+        try:
+            hashes = [row[0] for row in db.query(QuestionBank.content_hash).filter(self.claimable()).all()]
+        finally:
+            db.close()
+        for content_hash in hashes:
+            self._enqueue(content_hash)
+
+    def schedule(self, db, content_hash):
+        bank = db.get(QuestionBank, content_hash)
+        if bank is None:
+            db.add(QuestionBank(content_hash=content_hash))
+            db.commit()
+        elif bank.status == JobStatusEnum.completed:
+            return
+        elif bank.status == JobStatusEnum.running:
+            if bank.updated_at >= datetime.utcnow() - timedelta(seconds=self.lease_seconds):
+                return
+        elif bank.status == JobStatusEnum.failed:
+            bank.status = JobStatusEnum.pending
+            db.commit()
+        self._enqueue(content_hash)
+
+    def _enqueue(self, content_hash):
+        with self.lock:
+            if content_hash in self.queued:
+                return
+            self.queued.add(content_hash)
+        self.queue.put(content_hash)
+
+    def _worker(self):
+        while True:
+            content_hash = self.queue.get()
+            try:
+                self.build(content_hash)
+            except Exception as e:
+                print(f"Question bank for {content_hash} failed: {e}")
+            finally:
+                with self.lock:
+                    self.queued.discard(content_hash)
+
+    def _renew(self, db, content_hash):
+        # Extend the lease, False when the bank is gone or was taken over.
+        # Caller commits.
+        return bool(db.query(QuestionBank)
+                    .filter(QuestionBank.content_hash == content_hash, QuestionBank.status == JobStatusEnum.running)
+                    .update({QuestionBank.updated_at: datetime.utcnow()}, synchronize_session=False))
+
+    def _wait_for_idle(self, db=None, content_hash=None):
+        renewed = time.monotonic()
+        while self.is_busy():
+            time.sleep(self.idle_seconds)
+            if db is not None and time.monotonic() - renewed > self.lease_seconds / 3:
+                self._renew(db, content_hash)
+                db.commit()
+                renewed = time.monotonic()
+
+    def build(self, content_hash):
+        db = SessionLocal()
+        try:
+            # Claim the bank, another worker process may have got to it first
+            claimed = db.query(QuestionBank)\
+                .filter(QuestionBank.content_hash == content_hash, self.claimable())\
+                .update({QuestionBank.status: JobStatusEnum.running, QuestionBank.updated_at: datetime.utcnow()},
+                        synchronize_session=False)
+            db.commit()
+            if not claimed:
+                return
+
+            self._wait_for_idle(db, content_hash)
+            started = time.perf_counter()
+            try:
+                topics = self._build_topics(db, content_hash)
+            except Exception as e:
+                db.rollback()
+                db.query(QuestionBank).filter(QuestionBank.content_hash == content_hash)\
+                    .update({QuestionBank.status: JobStatusEnum.failed, QuestionBank.last_error: str(e)},
+                            synchronize_session=False)
+                db.commit()
+                raise
+
+            if topics is not None:
+                db.query(QuestionBank)\
+                    .filter(QuestionBank.content_hash == content_hash, QuestionBank.status == JobStatusEnum.running)\
+                    .update({QuestionBank.status: JobStatusEnum.completed, QuestionBank.topic_count: topics,
+                             QuestionBank.last_error: None}, synchronize_session=False)
+                db.commit()
+                log_event("question_bank", content_hash=content_hash, topics=topics,
+                          duration_ms=round((time.perf_counter() - started) * 1000, 2))
+        finally:
+            db.close()
+
+    def _build_topics(self, db, content_hash):
+        # Returns the number of topics banked, or None when the document
+        # went away or the lease was lost in the meantime. No transaction is held while waiting
+        # or calling the LLM: on SQLite an open write would lock out every
+        # other writer for that long.
+        clear_bank(db, content_hash, keep_bank=True)
+        db.commit()
+
+        with span("bank.load"):
+            topics = group_topics(load_chunks(db, content_hash))
+        db.rollback()
+
+        for position, (title, text, vector) in enumerate(topics):
+            generated = []
+            for kind, prompt in self.kinds.items():
+                self._wait_for_idle(db, content_hash)
+                with span(f"bank.{kind}"):
+                    response = get_llm().invoke(prompt.format(context=text))
+                generated.extend((kind, item) for item in parse_items(response.text()))
+                time.sleep(self.idle_seconds)
+
+            # One short transaction per topic, which also renews the lease
+            if not self._renew(db, content_hash):
+                db.rollback()
+                return None
+            topic = BankTopic(content_hash=content_hash, position=position, title=title,
+                              embedding=vector.astype(np.float32).tobytes())
+            db.add(topic)
+            db.flush()
+            for kind, item in generated:
+                db.add(BankItem(topic_id=topic.topic_id, kind=kind, content=json.dumps(item)))
+            db.commit()
+
+        return len(topics)
+
+
+bank_builder = BankBuilder()
+
+
+def clear_bank(db, content_hash, keep_bank=False):
+    # Caller commits
+    topic_ids = db.query(BankTopic.topic_id).filter(BankTopic.content_hash == content_hash)
+    db.query(BankItem).filter(BankItem.topic_id.in_(topic_ids.scalar_subquery()))\
+        .delete(synchronize_session=False)
+    db.query(BankTopic).filter(BankTopic.content_hash == content_hash).delete(synchronize_session=False)
+    if not keep_bank:
+        db.query(QuestionBank).filter(QuestionBank.content_hash == content_hash).delete(synchronize_session=False)
+
+
+def sample_from_bank(db, hashes, keywords, kind, size=Config.QUESTION_BANK_SAMPLE_SIZE,
+                     min_similarity=Config.QUESTION_BANK_MIN_SIMILARITY):
+    # Questions for the keywords drawn from the banks of the given
+    # documents, or None when a keyword isn't close enough to any banked
+    # topic (or too few questions match) and the LLM has to be asked.
+    if isinstance(keywords, str):
+        keywords = [keywords]
+    if not hashes or not keywords:
+        return None
+
+    topics = db.query(BankTopic.topic_id, BankTopic.embedding)\
+        .join(QuestionBank, QuestionBank.content_hash == BankTopic.content_hash)\
+        .filter(QuestionBank.content_hash.in_(hashes), QuestionBank.status == JobStatusEnum.completed)\
+        .all()
+    if not topics:
+        return None
+
+    matrix = np.array([np.frombuffer(embedding, dtype=np.float32) for _, embedding in topics])
+    queries = np.array(get_embeddings().embed_queries([str(keyword) for keyword in keywords]), dtype=np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True) + 1e-10
+    scores = queries @ matrix.T
+
+    if (scores.max(axis=1) < min_similarity).any():
+        return None
+
+    # One pool per keyword, drawn from in turn so every keyword is asked about
+    matched = {topics[i][0] for i in np.argwhere(scores >= min_similarity)[:, 1]}
+    items = {}
+    for topic_id, content in db.query(BankItem.topic_id, BankItem.content)\
+            .filter(BankItem.topic_id.in_(list(matched)), BankItem.kind == kind).all():
+        items.setdefault(topic_id, []).append(content)
+
+    pools = []
+    for row in scores:
+        pool = [content for i in np.flatnonzero(row >= min_similarity) for content in items.get(topics[i][0], [])]
+        random.shuffle(pool)
+        pools.append(pool)
+
+    chosen = []
+    seen = set()
+    while len(chosen) < size and any(pools):
+        for pool in pools:
+            while pool:
+                content = pool.pop()
+                if content not in seen:
+                    seen.add(content)
+                    chosen.append(content)
+                    break
+            if len(chosen) >= size:
+                break
+
+    if len(chosen) < max(1, size // 2):
+        return None
+
+    questions = []
+    for i, content in enumerate(chosen):
+        question = json.loads(content)
+        question["id"] = i + 1
+        questions.append(question)
+    return questions
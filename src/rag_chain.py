@@ -1,17 +1,19 @@
-from langchain_chroma import Chroma
-from langchain_ollama import OllamaEmbeddings, ChatOllama
-from langchain.chains import create_retrieval_chain
-from langchain_community.document_loaders import TextLoader
-from langchain.chains.combine_documents import create_stuff_documents_chain
 from config import Config
 import os
-from langchain_community.document_loaders import PyPDFLoader
+import math
+from langchain_core.documents import Document
+from pypdf import PdfReader
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from src.embedding_cache import CachedEmbeddings
+from src.metrics import watch_cache
+from src.pdf_extract import iter_pdf_pages
+from src.retrieval import HybridRetriever
+from src.resources import resources
 
-
-
+# Model clients and the vector store are built on first use through the
+# resource registry, so importing this module (and booting a worker) stays
+# cheap. Their libraries are imported there too.
 
 system_prompt = (
     "You are an AI assistant called RUNE designed for educational purposes. "
@@ -19,12 +21,14 @@ system_prompt = (
     "If you don't know the answer, say so. and ask the user if you want to generate without the context if user says yes give answer without context"
     "do not mention about names like 'user' and 'context' in the response"
     "You can view previous messages provided"
+    "Summary gives a summary of the earlier part of the conversation that is no longer in the previous messages"
     "DO NOT GENERATE ANY CODE"
     "Syllabus gives the relevent topics that the user need to study from the given notes"
     "If the syllabus is provided, then generate accurate responses for user queries according to the syllabus"
     "If the syllabus is provided and if the user query is about a topic that is not in the syllabus, say so and  ask the user if you need an answer out of the syllabus. If the user says yes, give the answer without referring to the syllabus"
     "If there is no syllabus given, Use the retrieved context to generate accurate responses.  "
     "\n\n"
+    "<summary>{history_summary}</summary>"
     "<syllabus>{syllabus}</syllabus>"
     "<context>{context}</context>"
 )
@@ -38,50 +42,160 @@ prompt = ChatPromptTemplate.from_messages(
 )
 
 
+def create_embeddings():
+    # The model wrapped in the query embedding cache, keyed by the name its
+    # vectors are stored under
+    if Config.EMBEDDING_BACKEND == "fake":
+        from src.fake_models import FakeEmbeddings
+        return CachedEmbeddings(FakeEmbeddings(), model_name=f"fake-{Config.FAKE_EMBEDDING_DIM}")
+
+    from langchain_ollama import OllamaEmbeddings
+    return CachedEmbeddings(OllamaEmbeddings(model=Config.EMBEDDING_MODEL), model_name=Config.EMBEDDING_MODEL)
+
+
+def create_llm():
+    if Config.LLM_BACKEND == "fake":
+        from src.fake_models import FakeChatModel
+        return FakeChatModel()
+    if Config.LLM_BACKEND == "ollama":
+        from langchain_ollama import ChatOllama
+        return ChatOllama(model=Config.LLM_MODEL, temperature=0.7)
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model="gemini-2.0-flash")
+
+
 def initialize_vectorstore():
-    embeddings = OllamaEmbeddings(model=Config.EMBEDDING_MODEL)
-    if os.path.exists(Config.CHROMA_DIR):
-        return Chroma(
-            persist_directory=Config.CHROMA_DIR,
-            embedding_function=embeddings
-        )
-    # Create a new empty vectorstore if none exists
+    import chromadb
+    from chromadb.config import Settings
+    from langchain_chroma import Chroma
+
+    settings = Settings(is_persistent=True, persist_directory=Config.CHROMA_DIR)
+    if Config.VECTOR_MEMORY_LIMIT_BYTES:
+        # Let Chroma unload the HNSW segments of idle partitions
+        settings.chroma_segment_cache_policy = "LRU"
+        settings.chroma_memory_limit_bytes = Config.VECTOR_MEMORY_LIMIT_BYTES
+
+    # Creates a new empty vectorstore if none exists
+    client = chromadb.PersistentClient(path=Config.CHROMA_DIR, settings=settings)
     return Chroma(
-        persist_directory=Config.CHROMA_DIR,
-        embedding_function=embeddings
+        client=client,
+        embedding_function=get_embeddings()
     )
 
-llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash")
-# llm = ChatOllama(model=Config.LLM_MODEL, temperature=0.7)
 
-def create_qa_chain(vectorstore, chat_id):
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 5, "filter": {
-        "chat_id": chat_id
-    }})
-    
-    question_answer_chain = create_stuff_documents_chain(llm, prompt)
-    rag_chain = create_retrieval_chain(retriever, question_answer_chain)
+resources.register("embeddings", create_embeddings)
+resources.register("vectorstore", initialize_vectorstore)
+resources.register("llm", create_llm)
+
+
+def get_embeddings():
+    return resources.get("embeddings")
+
+
+def get_vectorstore():
+    return resources.get("vectorstore")
+
 
-    return rag_chain
+def get_llm():
+    return resources.get("llm")
 
 
-vectorstore = initialize_vectorstore()
+def embedding_cache_stats():
+    # Scraping /metrics shouldn't be what loads the model
+    embeddings = resources.instances.get("embeddings")
+    return embeddings.stats() if embeddings is not None else None
 
-def process_documents(file_path: str):
-  text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200
-  )
-  if file_path.endswith(".txt"):
-      loader = TextLoader(file_path)
-      documents = loader.load()
-      return text_splitter.split_documents(documents)
-  elif file_path.endswith(".pdf"):
-      pdf = PyPDFLoader(file_path)
-      pages = pdf.load()
 
-      return text_splitter.split_documents(pages)
-  
+watch_cache("query_embeddings", embedding_cache_stats)
 
-  return []
 
+def warm_up():
+    # Open the vector store and its default collection, make one real
+    # embedding call (bypassing the query cache) and create the LLM client
+    get_vectorstore()._collection.count()
+    get_embeddings().embeddings.embed_query("warm up")
+    get_llm()
+
+
+def create_retriever(vectorstore, search_filter, content_hashes=None):
+    if Config.HYBRID_RETRIEVAL and content_hashes:
+        return HybridRetriever(vectorstore=vectorstore, search_filter=search_filter, content_hashes=content_hashes)
+    return vectorstore.as_retriever(search_kwargs={"k": 5, "filter": search_filter})
+
+
+def create_answer_chain():
+    # Retrieval happens separately so the retrieved chunks can be inspected
+    # (answer cache) before they are passed in as "context"
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    return create_stuff_documents_chain(get_llm(), prompt)
+
+
+def answer_messages(inputs, docs):
+    # The prompt create_answer_chain sends, with the documents joined the
+    # same way
+    return prompt.format_messages(**inputs, context="\n\n".join(doc.page_content for doc in docs))
+
+
+def stream_answer(inputs, docs, cancelled, llm=None):
+    # Answer text streamed from the model itself. Closing the answer
+    # chain's stream only returns once the model has produced everything,
+    # closing the model's stream stops it. Stops at the next chunk once
+    # cancelled is set.
+    stream = (llm or get_llm()).stream(answer_messages(inputs, docs))
+    try:
+        for chunk in stream:
+            if cancelled.is_set():
+                break
+            text = chunk.text()
+            if text:
+                yield text
+    finally:
+        stream.close()
+
+
+text_splitter = RecursiveCharacterTextSplitter(
+    chunk_size=Config.CHUNK_SIZE,
+    chunk_overlap=Config.CHUNK_OVERLAP
+)
+
+TEXT_BLOCK_SIZE = 64 * 1024
+
+
+def count_pages(file_path: str):
+    if file_path.endswith(".pdf"):
+        # pypdf only reads the page tree here, not the page contents
+        return len(PdfReader(file_path).pages)
+    if file_path.endswith(".txt"):
+        return max(1, math.ceil(os.path.getsize(file_path) / TEXT_BLOCK_SIZE))
+    return 0
+
+
+def load_pages(file_path: str):
+    # Yield the document one page at a time. Text files are cut into
+    # blocks on line boundaries so they are never held in memory whole.
+    if file_path.endswith(".txt"):
+        with open(file_path, encoding="utf-8") as f:
+            block = []
+            size = 0
+            for line in f:
+                block.append(line)
+                size += len(line)
+                if size >= TEXT_BLOCK_SIZE:
+                    yield Document(page_content="".join(block), metadata={"source": file_path})
+                    block = []
+                    size = 0
+            if block:
+                yield Document(page_content="".join(block), metadata={"source": file_path})
+    elif file_path.endswith(".pdf"):
+        for page_number, text in iter_pdf_pages(file_path):
+            yield Document(page_content=text, metadata={"source": file_path, "page": page_number})
+
+
+def extract_text(file_path: str):
+    return "\n".join(page.page_content for page in load_pages(file_path))
+
+
+def stream_documents(file_path: str):
+    # Split page by page, yielding the chunks of each page as soon as it is read
+    for page in load_pages(file_path):
+        yield text_splitter.split_documents([page])
@@ -0,0 +1,78 @@
+import threading
+import time
+
+
+class ResourceRegistry:
+    # Heavy resources (models, the vector store) registered by name and
+    # built on first use, once per process. Each resource has its own lock
+    # so a slow one doesn't hold up the others.
+
+    def __init__(self):
+        self.factories = {}
+        self.instances = {}
+        self.locks = {}
+        self.errors = {}
+        self.load_seconds = {}
+        self.ready = threading.Event()
+        self.warm_up_error = None
+
+    def register(self, name, factory):
+        self.factories[name] = factory
+        self.locks[name] = threading.Lock()
+
+    def get(self, name):
+        instance = self.instances.get(name)
+        if instance is not None:
+            return instance
+
+        with self.locks[name]:
+            instance = self.instances.get(name)
+            if instance is not None:
+                return instance
+
+            start = time.perf_counter()
+            try:
+                instance = self.factories[name]()
+            except Exception as e:
+                self.errors[name] = str(e)
+                raise
+            self.errors.pop(name, None)
+            self.load_seconds[name] = round(time.perf_counter() - start, 3)
+            self.instances[name] = instance
+            return instance
+
+    def status(self):
+        resources = {}
+        for name in self.factories:
+            if name in self.instances:
+                resources[name] = {"loaded": True, "load_seconds": self.load_seconds.get(name)}
+            else:
+                resources[name] = {"loaded": False, "error": self.errors.get(name)}
+        return {
+            "ready": self.ready.is_set(),
+            "warm_up_error": self.warm_up_error,
+            "resources": resources,
+        }
+
+    def warm_up(self, hook):
+        # Run the warm-up hook and mark the process ready once it succeeds
+        try:
+            hook()
+            self.warm_up_error = None
+            self.ready.set()
+        except Exception as e:
+            self.warm_up_error = str(e)
+            print(f"Warm up failed: {e}")
+
+    def start_warm_up(self, hook, retry_seconds):
+        # Keep retrying in the background, e.g. until Ollama is up
+        def run():
+            while not self.ready.is_set():
+                self.warm_up(hook)
+                if not self.ready.is_set():
+                    time.sleep(retry_seconds)
+
+        threading.Thread(target=run, name="warm-up", daemon=True).start()
+
+
+resources = ResourceRegistry()
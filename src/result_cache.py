@@ -0,0 +1,48 @@
+import hashlib
+import json
+from config import Config
+from src.cache import PersistentLRUCache
+from src.embedding_cache import normalize_text
+from src.metrics import watch_cache
+
+KINDS = ("mcq", "flashcard")
+
+result_cache = PersistentLRUCache(
+    Config.RESULT_CACHE_PATH,
+    "generated_results",
+    max_items=Config.RESULT_CACHE_MEMORY_ITEMS,
+    max_bytes=Config.RESULT_CACHE_MAX_BYTES
+)
+
+
+def normalize_keywords(keywords):
+    return sorted({normalize_text(keyword) for keyword in keywords if keyword and keyword.strip()})
+
+
+def prompt_version(prompt):
+    # Editing a prompt changes its version, so old results stop matching
+    return hashlib.sha256(repr(prompt.messages).encode()).hexdigest()[:12]
+
+
+def result_key(kind, chat, keywords, prompt):
+    digest = hashlib.sha256(
+        json.dumps([normalize_keywords(keywords), prompt_version(prompt)]).encode()
+    ).hexdigest()
+    return f"{kind}:{chat.chat_id}:{chat.corpus_version or 0}:{digest}"
+
+
+def get_result(key):
+    value = result_cache.get(key)
+    return value.decode("utf-8") if value is not None else None
+
+
+def store_result(key, text):
+    result_cache.set(key, text.encode("utf-8"))
+
+
+def invalidate_results(chat_id):
+    for kind in KINDS:
+        result_cache.delete_prefix(f"{kind}:{chat_id}:")
+
+
+watch_cache("generated_results", result_cache.stats)
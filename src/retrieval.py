@@ -0,0 +1,117 @@
+from typing import Any
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from config import Config
+from src.lexical import lexical_index
+
+
+def embed_keywords(vectorstore, keywords):
+    embeddings = vectorstore.embeddings
+    # CachedEmbeddings serves repeated keywords from cache and batches the rest
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(keywords)
+    return embeddings.embed_documents(keywords)
+
+
+def reciprocal_rank_fusion(rankings, k=Config.HYBRID_RRF_K):
+    # Each ranking is a best first list of ids. Only ranks count, so BM25 and
+    # vector distances never have to be put on the same scale.
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def lexical_document(chunk_id, content_hash, text):
+    return Document(
+        id=chunk_id,
+        page_content=text,
+        metadata={"content_hash": content_hash, "chunk_index": int(chunk_id.rsplit(":", 1)[1])}
+    )
+
+
+class HybridRetriever(BaseRetriever):
+    # Vector search and BM25 over the chat's documents, fused with RRF.
+    # Chunks written before content hashing only exist in the vector store.
+    vectorstore: Any
+    search_filter: dict
+    content_hashes: list
+    k: int = 5
+    candidates: int = Config.HYBRID_CANDIDATES
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        docs = {}
+
+        vector_ranking = []
+        for doc in self.vectorstore.similarity_search(query, k=self.candidates, filter=self.search_filter):
+            key = doc.id or doc.page_content
+            docs.setdefault(key, doc)
+            vector_ranking.append(key)
+
+        lexical_ranking = []
+        for chunk_id, content_hash, text in lexical_index.search(query, self.content_hashes, self.candidates):
+            docs.setdefault(chunk_id, lexical_document(chunk_id, content_hash, text))
+            lexical_ranking.append(chunk_id)
+
+        return [docs[key] for key in reciprocal_rank_fusion([vector_ranking, lexical_ranking])[:self.k]]
+
+
+def retrieve_context_for_keywords(vectorstore, keywords, search_filter, content_hashes=None, k=5,
+                                  max_chars=Config.KEYWORD_CONTEXT_MAX_CHARS, mode=Config.KEYWORD_RETRIEVAL):
+    # One embedding call and one Chroma query for all keywords instead of
+    # one of each per keyword, fused per keyword with BM25 in hybrid mode.
+    # Lexical mode never calls the embedding model.
+    keywords = list(dict.fromkeys(keyword.strip() for keyword in keywords if keyword and keyword.strip()))
+    if not keywords:
+        return ""
+
+    use_lexical = mode in ("hybrid", "lexical") and bool(content_hashes)
+    # Chats without hashed documents only have vectors to search
+    use_vector = mode != "lexical" or not use_lexical
+
+    texts = {}
+    rankings = [[] for _ in keywords]
+
+    if use_vector:
+        results = vectorstore._collection.query(
+            query_embeddings=embed_keywords(vectorstore, keywords),
+            n_results=Config.HYBRID_CANDIDATES if use_lexical else k,
+            where=search_filter,
+            include=["documents"]
+        )
+        for q in range(len(keywords)):
+            texts.update(zip(results["ids"][q], results["documents"][q]))
+            rankings[q].append(results["ids"][q])
+
+    if use_lexical:
+        for q, keyword in enumerate(keywords):
+            hits = lexical_index.search(keyword, content_hashes, Config.HYBRID_CANDIDATES)
+            texts.update((chunk_id, text) for chunk_id, _, text in hits)
+            rankings[q].append([chunk_id for chunk_id, _, _ in hits])
+
+    ids = [reciprocal_rank_fusion(ranking)[:k] for ranking in rankings]
+
+    # Take every keyword's best chunk before anyone's second best so the
+    # size cap doesn't cut whole keywords out of the context.
+    seen = set()
+    chunks = []
+    for rank in range(k):
+        for q in range(len(keywords)):
+            if rank >= len(ids[q]):
+                continue
+            chunk_id = ids[q][rank]
+            if chunk_id in seen:
+                continue
+            seen.add(chunk_id)
+            chunks.append(texts[chunk_id])
+
+    context = []
+    size = 0
+    for chunk in chunks:
+        if size + len(chunk) > max_chars:
+            break
+        context.append(chunk)
+        size += len(chunk)
+
+    return "\n\n".join(context)
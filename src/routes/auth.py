@@ -2,9 +2,16 @@ from flask import Blueprint, request, jsonify
 from functools import wraps
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
-from src.database import SessionLocal
+from src.database import SessionLocal, async_session
 import jwt
+import threading
+import time
+from collections import namedtuple
+from cachetools import TTLCache
+from sqlalchemy import event, select
+from config import Config
 from src.models import User
+from src.metrics import span
 
 
 JWT_SECRET = "your-jwt-secret-key-replace-this"  # Change this in production
@@ -13,6 +20,102 @@ JWT_EXPIRATION = 24 * 60 * 60  # 24 hours in seconds
 
 auth_router = Blueprint("auth", __name__)
 
+
+# Immutable snapshot of the fields routes need from the authenticated user
+AuthUser = namedtuple("AuthUser", ["user_id", "name", "email"])
+
+# Per-process caches so authenticated requests skip the users query and
+# re-verifying a token signature we've already checked
+_user_cache = TTLCache(maxsize=Config.AUTH_CACHE_SIZE, ttl=Config.AUTH_CACHE_TTL)
+_token_cache = TTLCache(maxsize=Config.AUTH_CACHE_SIZE, ttl=Config.AUTH_CACHE_TTL)
+_cache_lock = threading.Lock()
+
+
+def decode_token(token):
+    with _cache_lock:
+        payload = _token_cache.get(token)
+
+    if payload is not None:
+        if payload.get("exp") is not None and payload["exp"] <= time.time():
+            raise jwt.ExpiredSignatureError("Signature has expired")
+        return payload
+
+    payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+    with _cache_lock:
+        _token_cache[token] = payload
+    return payload
+
+
+def load_user(user_id):
+    with _cache_lock:
+        user = _user_cache.get(user_id)
+    if user is not None:
+        return user
+
+    db = SessionLocal()
+    try:
+        row = db.query(User).filter_by(user_id=user_id).first()
+        if not row:
+            return None
+        user = AuthUser(user_id=row.user_id, name=row.name, email=row.email)
+    finally:
+        db.close()
+
+    with _cache_lock:
+        _user_cache[user_id] = user
+    return user
+
+
+async def load_user_async(user_id):
+    with _cache_lock:
+        user = _user_cache.get(user_id)
+    if user is not None:
+        return user
+
+    async with async_session() as db:
+        result = await db.execute(select(User).filter_by(user_id=user_id))
+        row = result.scalars().first()
+        if not row:
+            return None
+        user = AuthUser(user_id=row.user_id, name=row.name, email=row.email)
+
+    with _cache_lock:
+        _user_cache[user_id] = user
+    return user
+
+
+async def authenticate_async(authorization):
+    # Same checks as token_required for the ASGI endpoints. Returns
+    # (user, None) or (None, (body, status)).
+    token = authorization.split(" ")[1] if authorization and " " in authorization else None
+
+    if not token:
+        return None, ({'message': 'Token is missing'}, 401)
+
+    try:
+        data = decode_token(token)
+        current_user = await load_user_async(data['user_id'])
+
+        if not current_user:
+            return None, ({'message': 'User not found'}, 401)
+
+    except Exception as e:
+        return None, ({'message': 'Token is invalid', 'error': str(e)}, 401)
+
+    return current_user, None
+
+
+def invalidate_user(user_id):
+    with _cache_lock:
+        _user_cache.pop(user_id, None)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    invalidate_user(target.user_id)
+
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -26,10 +129,9 @@ def token_required(f):
         
         try:
             # Decode the token
-            data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-            db = SessionLocal()
-            current_user = db.query(User).filter_by(user_id=data['user_id']).first()
-            db.close()
+            with span("auth"):
+                data = decode_token(token)
+                current_user = load_user(data['user_id'])
             
             if not current_user:
                 return jsonify({'message': 'User not found'}), 401
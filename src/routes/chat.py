@@ -1,15 +1,71 @@
 from flask import Blueprint, request, jsonify, Response, stream_with_context
+import queue
+import threading
+import time
+from config import Config
 import src.models as models
-from src.rag_chain import create_qa_chain, vectorstore
+from src.rag_chain import create_retriever, stream_answer, get_embeddings
+from src.index_manager import index_manager
 from src.routes.auth import token_required
 from src.database import get_db
-from langchain_core.messages import HumanMessage, AIMessage
+from src.documents import chat_content_hashes, scope_filter
+from src.history import load_history, schedule_summary
+from src.syllabus import relevant_syllabus, invalidate_syllabus
+from src.answer_cache import answer_cache, is_cacheable, chunk_ids, corpus_key
+from src.vector_gc import delete_chat_data
+from src.context_packer import pack_context
+from src.metrics import span, log_event, ACTIVE_STREAMS, LLM_FIRST_TOKEN_SECONDS, LLM_TOKENS
+from src.sse import sse_event, KEEP_ALIVE, SSE_HEADERS
+from src.pagination import paginate, page_headers, PaginationError
 
 
 
 chat_router = Blueprint("chat", __name__)
 
 
+def load_chat_state(db, chat):
+    # The database reads for one turn, shared by the WSGI and ASGI chat
+    # endpoints. Returns (history, content hashes in scope).
+    with span("chat.history"):
+        # Recent messages within the token budget, older ones are in the summary
+        history = load_history(db, chat.chat_id, chat.summarized_until)
+    with span("chat.scope"):
+        hashes = chat_content_hashes(db, chat.chat_id)
+    return history, hashes
+
+
+def chat_inputs(chat, message, history, syllabus):
+    return {
+        "input": message,
+        "chat_history": history,
+        "history_summary": chat.history_summary or "",
+        "syllabus": syllabus,
+    }
+
+
+def prepare_chat_inputs(db, chat, message):
+    # Everything the QA chain needs for one turn
+    history, hashes = load_chat_state(db, chat)
+    with span("chat.syllabus"):
+        # Only the syllabus topics relevant to this question
+        syllabus = relevant_syllabus(db, chat.chat_id, chat.corpus_version, message)
+    inputs = chat_inputs(chat, message, history, syllabus)
+    return inputs, scope_filter(chat.chat_id, hashes), hashes
+
+
+def cached_answer(chat, inputs, docs, hashes):
+    # Returns (cache key, cached answer). The key is None when this turn
+    # can't be cached at all.
+    if not is_cacheable(inputs):
+        return None, None
+
+    key = (
+        corpus_key(chat.chat_id, hashes, inputs["syllabus"]),
+        get_embeddings().embed_query(inputs["input"]),
+        chunk_ids(docs)
+    )
+    return key, answer_cache.lookup(*key)
+
 
 @chat_router.route('/', methods=['POST'])
 @token_required
@@ -25,7 +81,7 @@ def chat(current_user):
     print("Hello")
     try:
         # Get database session
-        db = next(get_db())
+        db = get_db()
 
         # Fetch chat with chat id and current_user.user_id
         chat = db.query(models.Chat).filter_by(chat_id=chat_id, user_id=current_user.user_id).first()
@@ -33,58 +89,115 @@ def chat(current_user):
         if not chat:
             return jsonify({"error": "invalid chat_id or user_id provided"}), 400
 
-        # Fetch previous messages for the chat
-        previous_messages = db.query(models.ChatMessage).filter_by(chat_id=chat_id).order_by(models.ChatMessage.timestamp.asc()).all()
-
-
-        history = [HumanMessage(content=msg.content) if not msg.is_bot else AIMessage(content=msg.content) for msg in previous_messages]
-
-        print(history)
+        # Embed the question once up front, the syllabus lookup and the
+        # retriever then get it from the query embedding cache
+        with span("chat.embed"):
+            get_embeddings().embed_query(data['message'])
+
+        inputs, search_filter, hashes = prepare_chat_inputs(db, chat, data['message'])
+
+        with span("chat.search"):
+            retriever = create_retriever(index_manager.for_chat(chat.user_id, chat_id), search_filter, hashes)
+            docs = retriever.invoke(data['message'])
+        cache_key, cached = cached_answer(chat, inputs, docs, hashes)
+        with span("chat.pack"):
+            context = pack_context(docs)
+
+        def produce(tokens, cancelled):
+            # Runs the LLM stream in its own thread so the response can send
+            # keep-alives while waiting, and stops the model as soon as the
+            # client is gone
+            try:
+                for text in stream_answer(inputs, context, cancelled):
+                    tokens.put(("token", text))
+                tokens.put(("done", None))
+            except Exception as e:
+                print(e)
+                tokens.put(("error", str(e)))
+
+        def save(answer):
+            with span("chat.persist"):
+                user_message = models.ChatMessage(
+                    chat_id=chat_id,
+                    content=data['message'],
+                    is_bot=False
+                )
+                db.add(user_message)
+                db.commit()
+                bot_message = models.ChatMessage(
+                    chat_id=chat_id,
+                    content=answer,
+                    is_bot=True
+                )
+                db.add(bot_message)
+                db.commit()
+
+            schedule_summary(chat_id)
+            return bot_message.message_id
 
-        # Save user message
-        user_message = models.ChatMessage(
-            chat_id=chat_id,
-            content=data['message'],
-            is_bot=False
-        )
-          # Commit user message before streaming
-
-        file = db.query(models.File).filter_by(chat_id=chat_id,file_type=models.FileTypeEnum.syllabus).first()
-
-        syllabus = ""
-
-        if file:
-            syllabus += file.content
-
-        # Generator to stream the QA chain response
-        qa_chain = create_qa_chain(vectorstore, chat_id)
         def generate():
-            full_bot_response = ""
-            # Assuming qa_chain.stream yields chunks of the response
-            for chunk in qa_chain.stream({
-                "input": data['message'],
-                "chat_history": history,
-                "syllabus": syllabus
-            }):
-                if "answer" in chunk:
-                    full_bot_response += chunk["answer"] + " "
-                    yield chunk["answer"] + " "
+            tokens = queue.Queue()
+            cancelled = threading.Event()
+            parts = []
+            saved = False
+            started = time.perf_counter()
+            first_token = None
+            ACTIVE_STREAMS.inc(route="chat")
+
+            try:
+                if cached is not None:
+                    parts.append(cached)
+                    yield sse_event("token", {"text": cached})
                 else:
-                    yield ""
-            # After streaming completes, save the full bot response to the database
-
-            db.add(user_message)
-            db.commit()
-            bot_message = models.ChatMessage(
-                chat_id=chat_id,
-                content=full_bot_response.strip(),
-                is_bot=True
-            )
-            db.add(bot_message)
-            db.commit()
+                    threading.Thread(target=produce, args=(tokens, cancelled), daemon=True).start()
+                    while True:
+                        try:
+                            kind, value = tokens.get(timeout=Config.SSE_HEARTBEAT_SECONDS)
+                        except queue.Empty:
+                            yield KEEP_ALIVE
+                            continue
+
+                        if kind == "token":
+                            if first_token is None:
+                                first_token = time.perf_counter() - started
+                                LLM_FIRST_TOKEN_SECONDS.observe(first_token, route="chat")
+                            LLM_TOKENS.inc(route="chat")
+                            parts.append(value)
+                            yield sse_event("token", {"text": value})
+                        elif kind == "done":
+                            break
+                        else:
+                            yield sse_event("error", {"error": value})
+                            return
+
+                answer = "".join(parts).strip()
+                message_id = save(answer)
+                saved = True
+
+                if cache_key and cached is None:
+                    answer_cache.store(*cache_key, answer)
+
+                yield sse_event("done", {"message_id": message_id})
+            finally:
+                # Reached early when the client disconnects (the server closes
+                # this generator) or the LLM fails. Keep what was generated.
+                cancelled.set()
+                answer = "".join(parts).strip()
+                if not saved and answer:
+                    save(answer)
+                ACTIVE_STREAMS.dec(route="chat")
+                log_event(
+                    "chat_stream",
+                    chat_id=chat_id,
+                    cached=cached is not None,
+                    completed=saved,
+                    chunks=len(parts),
+                    first_token_ms=round(first_token * 1000, 2) if first_token is not None else None,
+                    duration_ms=round((time.perf_counter() - started) * 1000, 2),
+                )
 
         # Return a streaming response
-        return Response(stream_with_context(generate()), mimetype='text/event-stream')
+        return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
 
     except Exception as e:
         print(e)
@@ -95,8 +208,11 @@ def chat(current_user):
 @token_required
 def get_chats(current_user):
     try:
-        db = next(get_db())
-        chats = db.query(models.Chat).filter(models.Chat.user_id == current_user.user_id).all()
+        db = get_db()
+        query = db.query(models.Chat).filter(models.Chat.user_id == current_user.user_id)
+
+        # Newest chats first page, use the X-Cursor-Before header to load older ones
+        page = paginate(query, models.Chat.created_at, models.Chat.chat_id, request.args, tail=True)
         
         # Convert to response format
         chat_list = [{
@@ -104,10 +220,12 @@ def get_chats(current_user):
             "title": chat.title,
             "created_at": chat.created_at.isoformat(),
             "user_id": chat.user_id
-        } for chat in chats]
+        } for chat in page["rows"]]
         
-        return jsonify(chat_list)
+        return jsonify(chat_list), 200, page_headers(page)
     
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
@@ -116,7 +234,7 @@ def get_chats(current_user):
 @token_required
 def get_bookmarked_chats(current_user):
     try:
-        db = next(get_db())
+        db = get_db()
         chats = db.query(models.Chat).filter_by(user_id=current_user.user_id, bookmarked=True).all()
         
         # Convert to response format
@@ -138,7 +256,7 @@ def get_bookmarked_chats(current_user):
 @token_required
 def bookmark_chat(current_user, chat_id):
     try:
-        db = next(get_db())
+        db = get_db()
         chat = db.query(models.Chat).filter_by(user_id=current_user.user_id, chat_id=chat_id).first()
 
         if not chat:
@@ -174,7 +292,7 @@ def create_chat(current_user):
 
         title = data["title"]
 
-        db = next(get_db())
+        db = get_db()
         
         # Create new chat
         new_chat = models.Chat(
@@ -208,18 +326,16 @@ def create_chat(current_user):
 @token_required
 def get_chat_messages(current_user, chat_id):
     try:
-        db = next(get_db())
+        db = get_db()
         
         # Check if chat exists
         chat = db.query(models.Chat).filter(models.Chat.chat_id == chat_id, models.Chat.user_id == current_user.user_id).first()
         if not chat:
             return jsonify({"error": "Chat not found"}), 404
         
-        # Get messages for the chat
-        messages = db.query(models.ChatMessage)\
-            .filter(models.ChatMessage.chat_id == chat_id)\
-            .order_by(models.ChatMessage.timestamp.asc())\
-            .all()
+        # Get the latest page of messages, or the page before/after a cursor
+        query = db.query(models.ChatMessage).filter(models.ChatMessage.chat_id == chat_id)
+        page = paginate(query, models.ChatMessage.timestamp, models.ChatMessage.message_id, request.args, tail=True)
         
         # Convert to response format
        
@@ -229,14 +345,19 @@ def get_chat_messages(current_user, chat_id):
             "is_bot": message.is_bot,
             "timestamp": message.timestamp.isoformat(),
             "chat_id": message.chat_id,
-        } for message in messages]
+        } for message in page["rows"]]
         
         return jsonify({
             "chat_id": chat_id,
             "messages": message_list,
-            "bookmarked": chat.bookmarked
+            "bookmarked": chat.bookmarked,
+            "has_more": page["has_more"],
+            "before": page["before"],
+            "after": page["after"]
         })
     
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
@@ -244,16 +365,20 @@ def get_chat_messages(current_user, chat_id):
 @token_required
 def delete_chat(current_user, chat_id):
     try:
-        db = next(get_db())
+        db = get_db()
         
         # Check if chat exists
         chat = db.query(models.Chat).filter(models.Chat.chat_id == chat_id, models.Chat.user_id == current_user.user_id).first()
         if not chat:
             return jsonify({"error": "Chat not found"}), 404
         
-        # Delete chat
+        # Delete messages, files and vectors, then the chat
+        delete_chat_data(db, chat_id)
         db.delete(chat)
         db.commit()
+
+        invalidate_syllabus(chat_id)
+        answer_cache.invalidate(chat_id)
         
         return jsonify({"message": "Chat deleted successfully"})
     
@@ -0,0 +1,201 @@
+import asyncio
+import time
+import uuid
+import anyio
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import select
+import src.models as models
+from src.database import async_session, SessionLocal
+from src.rag_chain import create_retriever, create_answer_chain, get_embeddings
+from src.index_manager import index_manager
+from src.routes.auth import authenticate_async
+from src.routes.chat import load_chat_state, chat_inputs, cached_answer
+from src.documents import scope_filter
+from src.syllabus import relevant_syllabus
+from src.answer_cache import answer_cache
+from src.history import schedule_summary
+from src.context_packer import pack_context
+from src.metrics import span, log_event, request_id_var, ACTIVE_STREAMS, LLM_FIRST_TOKEN_SECONDS, LLM_TOKENS
+from src.sse import sse_event, KEEP_ALIVE, SSE_HEADERS
+from config import Config
+
+
+chat_async_router = APIRouter()
+
+# Preflight requests fall through to Flask-CORS, the actual response needs the header too
+CORS_HEADERS = {"Access-Control-Allow-Origin": "*"}
+
+
+def error_response(body, status):
+    return JSONResponse(body, status_code=status, headers=CORS_HEADERS)
+
+
+def load_syllabus(chat_id, corpus_version, message):
+    # Runs in a worker thread: on a cold cache it reads the syllabus and
+    # embeds its topics, with its own sync session
+    db = SessionLocal()
+    try:
+        return relevant_syllabus(db, chat_id, corpus_version, message)
+    finally:
+        db.close()
+
+
+@chat_async_router.post("/")
+async def chat(request: Request):
+    request_id_var.set(request.headers.get("X-Request-ID") or uuid.uuid4().hex)
+    with span("auth"):
+        current_user, error = await authenticate_async(request.headers.get("Authorization"))
+    if error:
+        return error_response(*error)
+
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+
+    if not data or 'message' not in data:
+        return error_response({"error": "No message provided"}, 400)
+
+    chat_id = data.get('chat_id')
+    if not chat_id:
+        return error_response({"error": "No chat_id provided"}, 400)
+
+    try:
+        async with async_session() as db:
+            result = await db.execute(
+                select(models.Chat).filter_by(chat_id=chat_id, user_id=current_user.user_id)
+            )
+            chat = result.scalars().first()
+
+            if not chat:
+                return error_response({"error": "invalid chat_id or user_id provided"}, 400)
+
+            # Embed the question off the event loop first. The syllabus lookup
+            # and the retriever then get it from the query embedding cache.
+            with span("chat.embed"):
+                await get_embeddings().aembed_query(data['message'])
+
+            # Only the database reads run on the aiosqlite connection
+            history, hashes = await db.run_sync(load_chat_state, chat)
+
+        # Everything else that blocks (embedding, the vector store, the
+        # caches) runs in worker threads, off the event loop
+        with span("chat.syllabus"):
+            syllabus = await anyio.to_thread.run_sync(load_syllabus, chat_id, chat.corpus_version, data['message'])
+        inputs = chat_inputs(chat, data['message'], history, syllabus)
+        search_filter = scope_filter(chat_id, hashes)
+
+        def search():
+            with span("chat.search"):
+                retriever = create_retriever(index_manager.for_chat(chat.user_id, chat_id), search_filter, hashes)
+                docs = retriever.invoke(data['message'])
+            cache_key, cached = cached_answer(chat, inputs, docs, hashes)
+            with span("chat.pack"):
+                context = pack_context(docs)
+            return cache_key, cached, context, create_answer_chain()
+
+        cache_key, cached, context, answer_chain = await anyio.to_thread.run_sync(search)
+
+        async def produce(tokens):
+            try:
+                async for chunk in answer_chain.astream({**inputs, "context": context}):
+                    await tokens.put(("token", chunk))
+                await tokens.put(("done", None))
+            except Exception as e:
+                print(e)
+                await tokens.put(("error", str(e)))
+
+        async def save(answer):
+            with span("chat.persist"):
+                async with async_session() as db:
+                    db.add(models.ChatMessage(
+                        chat_id=chat_id,
+                        content=data['message'],
+                        is_bot=False
+                    ))
+                    await db.commit()
+                    bot_message = models.ChatMessage(
+                        chat_id=chat_id,
+                        content=answer,
+                        is_bot=True
+                    )
+                    db.add(bot_message)
+                    await db.commit()
+
+            schedule_summary(chat_id)
+            return bot_message.message_id
+
+        async def generate():
+            tokens = asyncio.Queue()
+            producer = None
+            parts = []
+            saved = False
+            started = time.perf_counter()
+            first_token = None
+            ACTIVE_STREAMS.inc(route="chat_async")
+
+            try:
+                if cached is not None:
+                    parts.append(cached)
+                    yield sse_event("token", {"text": cached})
+                else:
+                    producer = asyncio.create_task(produce(tokens))
+                    while True:
+                        try:
+                            kind, value = await asyncio.wait_for(tokens.get(), Config.SSE_HEARTBEAT_SECONDS)
+                        except asyncio.TimeoutError:
+                            yield KEEP_ALIVE
+                            continue
+
+                        if kind == "token":
+                            if first_token is None:
+                                first_token = time.perf_counter() - started
+                                LLM_FIRST_TOKEN_SECONDS.observe(first_token, route="chat_async")
+                            LLM_TOKENS.inc(route="chat_async")
+                            parts.append(value)
+                            yield sse_event("token", {"text": value})
+                        elif kind == "done":
+                            break
+                        else:
+                            yield sse_event("error", {"error": value})
+                            return
+
+                answer = "".join(parts).strip()
+                message_id = await save(answer)
+                saved = True
+
+                if cache_key and cached is None:
+                    answer_cache.store(*cache_key, answer)
+
+                yield sse_event("done", {"message_id": message_id})
+            finally:
+                # Starlette cancels this generator when the client disconnects.
+                # Cancelling the producer stops the upstream LLM stream, and the
+                # partial answer is saved outside the cancelled scope.
+                if producer and not producer.done():
+                    producer.cancel()
+                answer = "".join(parts).strip()
+                if not saved and answer:
+                    with anyio.CancelScope(shield=True):
+                        await save(answer)
+                ACTIVE_STREAMS.dec(route="chat_async")
+                log_event(
+                    "chat_stream",
+                    chat_id=chat_id,
+                    cached=cached is not None,
+                    completed=saved,
+                    chunks=len(parts),
+                    first_token_ms=round(first_token * 1000, 2) if first_token is not None else None,
+                    duration_ms=round((time.perf_counter() - started) * 1000, 2),
+                )
+
+        return StreamingResponse(
+            generate(),
+            media_type="text/event-stream",
+            headers={**CORS_HEADERS, **SSE_HEADERS}
+        )
+
+    except Exception as e:
+        print(e)
+        return error_response({"error": str(e)}, 500)
@@ -1,7 +1,17 @@
+import json
 from flask import Blueprint, jsonify, request
 from langchain_core.prompts import ChatPromptTemplate
-from src.rag_chain import vectorstore, llm
+from config import Config
+from src.rag_chain import get_llm
+from src.index_manager import index_manager
 from src.routes.auth import token_required
+from src.database import get_db
+from src.documents import chat_content_hashes, scope_filter
+from src.retrieval import retrieve_context_for_keywords
+from src.result_cache import result_key, get_result, store_result
+from src.models import Chat
+from src.metrics import span, GENERATION_REQUESTS
+from src.question_bank import bank_builder, sample_from_bank
 
 flashcard_prompt = ChatPromptTemplate.from_messages(
     [
@@ -18,49 +28,66 @@ flashcard_prompt = ChatPromptTemplate.from_messages(
 
 flashcard_router = Blueprint("flashcard", __name__)
 
+bank_builder.register_kind("flashcard", flashcard_prompt)
+
 
 
 @flashcard_router.route("/<chat_id>/", methods=["POST"])
 @token_required
 def generate_flashcards(current_user, chat_id):
     try:
+        db = get_db()
         keywords = request.json.get("keywords")
 
 
         if not keywords:
             return jsonify({"error": "No keywords provided"}), 400
+
+        chat = db.query(Chat).filter_by(chat_id=chat_id, user_id=current_user.user_id).first()
+        if not chat:
+            return jsonify({"error": "Invalid chat_id"}), 404
+
+        # Same keywords against unchanged files give the same result, unless
+        # the user explicitly asks to regenerate
+        cache_key = result_key("flashcard", chat, keywords, flashcard_prompt)
+        if not request.json.get("regenerate"):
+            with span("flashcard.cache"):
+                cached = get_result(cache_key)
+            if cached is not None:
+                GENERATION_REQUESTS.inc(kind="flashcard", cached="true")
+                return jsonify({ "data": cached, "cached": True}), 200
         
 
-        context = retrieve_context_based_on_keyword(keywords, chat_id)
+        hashes = chat_content_hashes(db, chat_id)
+        if Config.QUESTION_BANK_ENABLED and not request.json.get("regenerate"):
+            # Keywords covered by the pre-generated bank don't need the LLM
+            with span("flashcard.bank"):
+                banked = sample_from_bank(db, hashes, keywords, "flashcard")
+            if banked is not None:
+                GENERATION_REQUESTS.inc(kind="flashcard", cached="bank")
+                return jsonify({ "data": json.dumps(banked), "cached": False, "bank": True}), 200
+
+        with span("flashcard.retrieval"):
+            context = retrieve_context_for_keywords(
+                index_manager.for_chat(current_user.user_id, chat_id),
+                keywords,
+                scope_filter(chat_id, hashes),
+                hashes
+            )
 
         
         
         print(keywords)
 
         flashcard_prompt_with_context = flashcard_prompt.format(context=context)
-        response = llm.invoke(flashcard_prompt_with_context)
+        with span("flashcard.llm"):
+            response = get_llm().invoke(flashcard_prompt_with_context)
 
         text = response.text()
+        store_result(cache_key, text)
+        GENERATION_REQUESTS.inc(kind="flashcard", cached="false")
 
-        return jsonify({ "data": text}), 200
+        return jsonify({ "data": text, "cached": False}), 200
     except Exception as e:
         print(e)
-        return jsonify({"error": "Internal server error"}), 500
-
-
-def retrieve_context_based_on_keyword(keywords, chat_id):
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 5, "filter": {
-        "chat_id": chat_id
-    }})
-
-    final_str = ""
-
-    for keyword in keywords:
-
-        relevant_docs = retriever.invoke(keyword)
-
-        context = " ".join([doc.page_content for doc in relevant_docs])
-
-        final_str += context
-
-    return final_str
\ No newline at end of file
+        return jsonify({"error": "Internal server error"}), 500
\ No newline at end of file
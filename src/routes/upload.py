@@ -1,14 +1,26 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from config import Config
-from src.rag_chain import process_documents, vectorstore
+from src.rag_chain import extract_text
+from src.index_manager import index_manager
+from src.pipeline import ingest_document
 import os
 from src.routes.auth import token_required
-from src.models import Chat, File, FileTypeEnum
-from src.database import get_db
+from src.models import Chat, File, FileTypeEnum, generate_uuid
+from src.database import get_db, SessionLocal
 from src.file import FileMemory
+from src.progress import FINISHED, snapshot
+from src.sse import sse_event, KEEP_ALIVE, SSE_HEADERS
+from src.metrics import span, log_event, INGEST_FILES, INGEST_QUEUE_DEPTH
+from src.ingest import IngestionQueue, QueueFullError
+from src.syllabus import build_topics, invalidate_syllabus
+from src.vector_gc import release_file
+from src.question_bank import bank_builder
+from src.pagination import paginate, page_headers, PaginationError
+from src.documents import save_and_hash, hash_file, get_or_create_document, is_document_ready, corpus_changed
+from datetime import datetime
 import threading
-from langchain_community.document_loaders import PyPDFLoader
+import time
 
 
 files = FileMemory()
@@ -31,14 +43,15 @@ def get_all_files(current_user, chat_id):
 
 
     try:
-        db = next(get_db())
+        db = get_db()
 
         chat = db.query(Chat).filter_by(chat_id=chat_id, user_id=current_user.user_id).first()
         if not chat:
             return jsonify({"error": "Invalid chat_id"}), 404
     
 
-        files = db.query(File).filter_by(chat_id=chat_id).all()
+        query = db.query(File).filter_by(chat_id=chat_id)
+        page = paginate(query, File.file_name, File.file_id, request.args)
 
         processed_files = [
             {
@@ -46,37 +59,103 @@ def get_all_files(current_user, chat_id):
                 "file_name": file.file_name,
                 "status": file.status.value,
                 "file_type": file.file_type.value
-            } for file in files
+            } for file in page["rows"]
         ]
 
-        return jsonify(processed_files), 200
+        return jsonify(processed_files), 200, page_headers(page)
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(e)
         return jsonify({"error": str(e)}), 500 
 
+# Every long poll and progress stream holds a worker thread while it waits
+progress_waiters = threading.BoundedSemaphore(Config.PROGRESS_MAX_WAITERS)
+
+
+def progress_payload(file):
+    if file["status"] == "completed":
+        return {"progress": 100, "completed": True}
+
+    if file["status"] == "failed":
+        return {"progress": file.get("progress"), "completed": False, "failed": True}
+
+    return {"progress": file.get("progress"), "completed": False}
+
+
 @upload_router.route('/progress/<file_id>', methods=['GET'])
 @token_required
 def get_file_progress(current_user, file_id):
+    # Long-poll with ?wait=<seconds>&progress=<last seen>: the response is
+    # held until the progress moves, the upload finishes or wait runs out
     try:
         file = files.get_file(file_id)
-        print(file)
         if not file:
             return jsonify({"error": "Invalid file_id"}), 404
         
         
         if file["user_id"] != current_user.user_id:
             return jsonify({"error": "Unauthorized"}), 401
-        
-        if file["status"] == "completed":
-            return jsonify({"progress": 100, "completed": True}), 200
-        
 
-        
-        return jsonify({"progress": file.get("progress"), "completed": False}), 200
+        wait = min(float(request.args.get("wait", 0)), Config.PROGRESS_LONG_POLL_MAX)
+        # Past PROGRESS_MAX_WAITERS the current progress is returned at once
+        # and the client simply polls again
+        if wait > 0 and progress_waiters.acquire(blocking=False):
+            try:
+                seen = snapshot(file)
+                if "progress" in request.args:
+                    seen = (file["status"], float(request.args["progress"]))
+                file = files.wait_for_change(file_id, seen, wait) or file
+            finally:
+                progress_waiters.release()
+
+        return jsonify(progress_payload(file)), 200
+    except ValueError:
+        return jsonify({"error": "wait and progress must be numbers"}), 400
     except Exception as e:
         print(e)
         return jsonify({"error": str(e)}), 500
 
+
+@upload_router.route('/progress/<file_id>/stream', methods=['GET'])
+@token_required
+def stream_file_progress(current_user, file_id):
+    # Pushes a "progress" event whenever the progress changes and a final
+    # "done" event once the upload completed or failed
+    file = files.get_file(file_id)
+    if not file:
+        return jsonify({"error": "Invalid file_id"}), 404
+
+    if file["user_id"] != current_user.user_id:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    if not progress_waiters.acquire(blocking=False):
+        return jsonify({"error": "Too many progress streams, poll /progress/<file_id> instead"}), 503, {"Retry-After": "5"}
+
+    def generate():
+        seen = None
+        deadline = time.monotonic() + Config.PROGRESS_STREAM_TIMEOUT
+        while time.monotonic() < deadline:
+            current = files.wait_for_change(file_id, seen, Config.SSE_HEARTBEAT_SECONDS)
+            if current is None:
+                yield sse_event("error", {"error": "Invalid file_id"})
+                return
+
+            if snapshot(current) == seen:
+                yield KEEP_ALIVE
+                continue
+
+            seen = snapshot(current)
+            if current["status"] in FINISHED:
+                yield sse_event("done", progress_payload(current))
+                return
+            yield sse_event("progress", progress_payload(current))
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
+    # Runs when the server closes the response, even if it never started
+    response.call_on_close(progress_waiters.release)
+    return response
+
     
 
 
@@ -92,7 +171,7 @@ def delete_file(current_user, file_id):
     chat_id = data.get('chat_id')
 
     try:
-        db = next(get_db())
+        db = get_db()
 
         chat = db.query(Chat).filter_by(chat_id=chat_id, user_id=current_user.user_id).first()
         if not chat:
@@ -104,9 +183,18 @@ def delete_file(current_user, file_id):
         if not file:
             return jsonify({"error": "Invalid file_id"}), 404
         
+        content_hash = file.content_hash
         db.delete(file)
         db.commit()
 
+        # Drop the shared chunks once no other file uses the same content
+        if content_hash:
+            release_file(db, current_user.user_id, chat_id, content_hash)
+
+        if file.file_type == FileTypeEnum.syllabus:
+            invalidate_syllabus(chat_id)
+        corpus_changed(db, chat_id)
+
         deleted_file = {
             "file_id": file.file_id,
             "file_name": file.file_name,
@@ -120,60 +208,125 @@ def delete_file(current_user, file_id):
         return jsonify({"error": str(e)}), 500
     
 def process_file(file_path, chat_id, file_id):
-    
-
+    # Runs on an ingestion worker, outside of any request
+    db = SessionLocal()
+    started = time.perf_counter()
+    result = "error"
+    try:
+        with span("ingest.total"):
+            ok = _process_file(db, file_path, chat_id, file_id)
+        result = "processed" if ok else "error"
+        return ok
+    finally:
+        db.close()
+        INGEST_FILES.inc(result=result)
+        log_event("ingest", file_id=file_id, chat_id=chat_id, result=result,
+                  duration_ms=round((time.perf_counter() - started) * 1000, 2))
+
+
+def _process_file(db, file_path, chat_id, file_id):
+    file_row = db.query(File).filter_by(chat_id=chat_id, file_id=file_id).first()
+
+    if not file_row:
+        # The file was deleted while it was waiting in the queue
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        return True
+
+    # After a restart the in-memory progress entry is gone, so rebuild it
+    if not files.get_file(file_id):
+        files.add_file(file_id, {
+            "file_id": file_id,
+            "file_name": file_row.file_name,
+            "user_id": file_row.chat.user_id,
+            "file_type": file_row.file_type.value,
+        })
 
     file = files.get_file(file_id)
 
-    whole_text = ""
+    if not file_row.content_hash:
+        with span("ingest.hash"):
+            file_row.content_hash = hash_file(file_path)
+        db.commit()
 
-    if file["file_type"] == "syllabus":
+    content_hash = file_row.content_hash
+    document = get_or_create_document(db, content_hash)
 
-        loader = PyPDFLoader(file_path)
+    if file["file_type"] == "syllabus":
 
-        pages = loader.load()
+        if document.text is None:
+            with span("ingest.extract"):
+                document.text = extract_text(file_path)
+            document.processed_at = datetime.utcnow()
+            db.commit()
 
-        whole_text = "\n".join([page.page_content for page in pages])
+        with span("ingest.topics"):
+            build_topics(db, document)
 
 
     else:
-        splits = process_documents(file_path)
+        # Chunks embedded for another partition are copied rather than re-embedded
+        partition = index_manager.partition_for(file["user_id"], chat_id)
+        with span("ingest.copy"):
+            copied = index_manager.ensure_document(db, content_hash, partition)
+        if not copied:
+            with span("ingest.pipeline"):
+                chunk_count = ingest_document(
+                    index_manager.get(partition),
+                    file_path,
+                    content_hash,
+                    on_progress=lambda progress: files.update_progress(file_id, progress)
+                )
+            index_manager.record_document(db, content_hash, partition)
+
+            document.chunk_count = chunk_count
+            document.processed_at = datetime.utcnow()
+            db.commit()
 
-        for split in splits:
-            # Add chat_id to metadata
-            if not split.metadata:
-                split.metadata = {}
-            split.metadata['chat_id'] = chat_id
 
-        if vectorstore:
 
-            batch_size = 10
-            total_size = len(splits)
-            for i in range(0, len(splits), batch_size):
-                vectorstore.add_documents(splits[i:min(i+batch_size, total_size)])
-                progress = ((i + batch_size) / total_size) * 100
-                files.update_progress(file_id, progress)
+    try:
+        file_row.status = "processed"
+        if file_row.file_type.value == "syllabus":
+            file_row.content = document.text
+        db.commit()
+        db.refresh(file_row)
+    except Exception as e:
+        print(e)
+        return False
 
-    
+    if file_row.file_type == FileTypeEnum.syllabus:
+        invalidate_syllabus(chat_id)
+    elif Config.QUESTION_BANK_ENABLED:
+        bank_builder.schedule(db, content_hash)
+    corpus_changed(db, chat_id)
 
     files.set_file_completed(file_id)
     os.remove(file_path)
 
+    return True
 
 
+def process_file_failed(file_id):
+    INGEST_FILES.inc(result="failed")
+    db = SessionLocal()
     try:
-        db = next(get_db())
-        file = db.query(File).filter_by(chat_id=chat_id, file_id=file_id).first()
-        file.status = "processed"
-        if file.file_type.value == "syllabus":
-            file.content = whole_text
-        db.commit()
-        db.refresh(file)
+        file_row = db.query(File).filter_by(file_id=file_id).first()
+        if file_row:
+            file_row.status = "failed"
+            db.commit()
     except Exception as e:
         print(e)
-        return False
-    
-    return True
+    finally:
+        db.close()
+
+    if files.get_file(file_id):
+        files.set_file_failed(file_id)
+
+
+ingest_queue = IngestionQueue(process_file, on_failed=process_file_failed)
+INGEST_QUEUE_DEPTH.set_callback(ingest_queue.depth)
+bank_builder.set_busy_check(lambda: ingest_queue.depth() > 0)
 
 
 @upload_router.route('/new', methods=['POST'])
@@ -198,17 +351,22 @@ def upload_file(current_user):
     
 
     if file and allowed_file(file.filename):
+        if ingest_queue.is_full(current_user.user_id):
+            return jsonify({"error": "Too many files are being processed, try again later"}), 429
+
         os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
         filename = secure_filename(file.filename)
-        file_path = os.path.join(Config.UPLOAD_FOLDER, filename)
-        file.save(file_path)
+        # Queued files wait on disk, so two uploads with the same name must not collide
+        file_path = os.path.join(Config.UPLOAD_FOLDER, f"{generate_uuid()}_{filename}")
+        content_hash = save_and_hash(file, file_path)
 
         try:
-            db = next(get_db())
+            db = get_db()
 
             chat = db.query(Chat).filter_by(chat_id=chat_id, user_id=current_user.user_id).first()
 
             if not chat:
+                os.remove(file_path)
                 return jsonify({"error": "Invalid chat_id"}), 404
             
             new_file = File(
@@ -216,12 +374,40 @@ def upload_file(current_user):
                 chat_id=chat_id,
                 file_type=file_type,
                 status="pending",
+                content_hash=get_or_create_document(db, content_hash).content_hash,
             )
 
             db.add(new_file)
             db.commit()
             db.refresh(new_file)
 
+            ready = is_document_ready(new_file.document, file_type)
+            if ready and file_type == "notes":
+                partition = index_manager.partition_for(current_user.user_id, chat_id)
+                ready = index_manager.ensure_document(db, content_hash, partition)
+
+            if ready:
+                # Same bytes were already processed for some chat, reuse them
+                new_file.status = "processed"
+                if file_type == "syllabus":
+                    new_file.content = new_file.document.text
+                db.commit()
+
+                if file_type == "syllabus":
+                    invalidate_syllabus(chat_id)
+                corpus_changed(db, chat_id)
+                os.remove(file_path)
+
+                files.add_file(new_file.file_id, {
+                    "file_id": new_file.file_id,
+                    "file_name": filename,
+                    "user_id": current_user.user_id,
+                    "file_type": new_file.file_type.value,
+                })
+                files.set_file_completed(new_file.file_id)
+
+                return jsonify({"message": "File processed successfully", "file_id": new_file.file_id}), 200
+
             files.add_file(new_file.file_id, {
                 "file_id": new_file.file_id,
                 "file_name": filename,
@@ -232,10 +418,16 @@ def upload_file(current_user):
             })
             
 
-            threading.Thread(target=process_file, args=(file_path, chat_id, new_file.file_id)).start()
+            try:
+                ingest_queue.submit(new_file.file_id, chat_id, current_user.user_id, file_path)
+            except QueueFullError as e:
+                db.delete(new_file)
+                db.commit()
+                os.remove(file_path)
+                return jsonify({"error": str(e)}), 429
 
 
-            return jsonify({"message": "File processed successfully"}), 200
+            return jsonify({"message": "File processed successfully", "file_id": new_file.file_id}), 200
         except Exception as e:
             print(e)
             return jsonify({"error": str(e)}), 500
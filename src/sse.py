@@ -0,0 +1,16 @@
+import json
+
+# Comment lines are ignored by EventSource clients but keep proxies and
+# load balancers from timing out an idle stream, and make a write fail
+# promptly once the client has gone away
+KEEP_ALIVE = ": keep-alive\n\n"
+
+# Tell nginx and friends not to buffer the stream
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
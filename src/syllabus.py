@@ -0,0 +1,130 @@
+import re
+import threading
+from array import array
+import numpy as np
+from cachetools import TTLCache
+from config import Config
+from src.models import File, FileStatusEnum, FileTypeEnum, SyllabusTopic
+from src.rag_chain import get_embeddings
+
+# Lines that open a new section of a syllabus, e.g. "Module 2: Trees"
+SECTION_RE = re.compile(r"^(module|unit|chapter|week|part|lecture)\b", re.IGNORECASE)
+
+_cache = TTLCache(maxsize=Config.SYLLABUS_CACHE_SIZE, ttl=Config.SYLLABUS_CACHE_TTL)
+_cache_lock = threading.Lock()
+
+
+def split_topics(text):
+    sections = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if not sections or SECTION_RE.match(line):
+            sections.append([])
+        sections[-1].append(line)
+
+    # Long sections are cut on line boundaries, repeating the section
+    # heading so every topic still says where it belongs
+    topics = []
+    for lines in sections:
+        current = []
+        size = 0
+        for line in lines:
+            if current and size + len(line) > Config.SYLLABUS_TOPIC_MAX_CHARS:
+                topics.append(current)
+                current = [lines[0]] if SECTION_RE.match(lines[0]) else []
+                size = sum(len(part) + 1 for part in current)
+            current.append(line)
+            size += len(line) + 1
+        if current:
+            topics.append(current)
+
+    return ["\n".join(topic) for topic in topics]
+
+
+def build_topics(db, document):
+    if document.topics or not document.text:
+        return
+
+    contents = split_topics(document.text)
+    if not contents:
+        return
+
+    vectors = get_embeddings().embed_documents(contents)
+    for position, (content, vector) in enumerate(zip(contents, vectors)):
+        db.add(SyllabusTopic(
+            content_hash=document.content_hash,
+            position=position,
+            title=content.splitlines()[0][:200],
+            content=content,
+            embedding=array("f", vector).tobytes()
+        ))
+    db.commit()
+
+
+def _load(db, chat_id):
+    files = db.query(File)\
+        .filter(File.chat_id == chat_id,
+                File.file_type == FileTypeEnum.syllabus,
+                File.status == FileStatusEnum.processed)\
+        .all()
+
+    topics = []
+    vectors = []
+    for file in files:
+        if file.document and file.document.text is not None:
+            # Syllabi stored before topics existed get them on first use
+            build_topics(db, file.document)
+            for topic in file.document.topics:
+                topics.append(topic.content)
+                vectors.append(array("f", topic.embedding).tolist() if topic.embedding else None)
+        elif file.content:
+            for content in split_topics(file.content):
+                topics.append(content)
+                vectors.append(None)
+
+    full = "\n\n".join(topics)
+    if len(full) <= Config.SYLLABUS_FULL_MAX_CHARS or len(topics) <= Config.SYLLABUS_TOP_K:
+        return {"topics": topics, "matrix": None, "full": full}
+
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        for i, vector in zip(missing, get_embeddings().embed_documents([topics[i] for i in missing])):
+            vectors[i] = vector
+
+    matrix = np.array(vectors, dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-10
+    return {"topics": topics, "matrix": matrix, "full": full}
+
+
+def invalidate_syllabus(chat_id):
+    # Only frees memory in this process, other processes miss on the
+    # bumped corpus version instead
+    with _cache_lock:
+        for key in [key for key in _cache.keys() if key[0] == chat_id]:
+            _cache.pop(key, None)
+
+
+def relevant_syllabus(db, chat_id, corpus_version, question):
+    # Syllabus topics closest to the question, in syllabus order. The
+    # topics for a chat are cached per corpus version, which every change
+    # to its files bumps.
+    key = (chat_id, corpus_version or 0)
+    with _cache_lock:
+        entry = _cache.get(key)
+
+    if entry is None:
+        entry = _load(db, chat_id)
+        with _cache_lock:
+            _cache[key] = entry
+
+    if entry["matrix"] is None:
+        return entry["full"]
+
+    query = np.array(get_embeddings().embed_query(question), dtype=np.float32)
+    query /= np.linalg.norm(query) + 1e-10
+    scores = entry["matrix"] @ query
+    top = sorted(np.argsort(-scores)[:Config.SYLLABUS_TOP_K])
+
+    return "\n\n".join(entry["topics"][i] for i in top)
@@ -0,0 +1,249 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from config import Config
+from src.database import SessionLocal
+from src.models import Chat, ChatMessage, Document, DocumentPartition, File, IngestionJob, SyllabusTopic
+from src.index_manager import index_manager
+from src.lexical import lexical_index
+from src.question_bank import clear_bank
+
+# Chunks are shared by every File with the same content, so they are
+# reference counted through File.content_hash rather than tagged with a
+# single file_id: a Document and its chunks go away with the last File
+# pointing at it. Chunks written before content hashing only carry a
+# chat_id and go away with their chat.
+
+
+def release_document(db, content_hash):
+    if db.query(File).filter(File.content_hash == content_hash).first():
+        return False
+
+    index_manager.delete_document(db, content_hash)
+    lexical_index.delete(content_hash)
+    clear_bank(db, content_hash)
+    db.query(SyllabusTopic).filter(SyllabusTopic.content_hash == content_hash).delete(synchronize_session=False)
+    db.query(Document).filter(Document.content_hash == content_hash).delete(synchronize_session=False)
+    db.commit()
+    return True
+
+
+def release_file(db, user_id, chat_id, content_hash):
+    # A file using content_hash was removed from the chat: drop the copy in
+    # the chat's partition if nothing else routed there uses it, and the
+    # document itself if nothing uses it at all
+    index_manager.release_partition(db, content_hash, index_manager.partition_for(user_id, chat_id))
+    release_document(db, content_hash)
+
+
+def delete_chat_data(db, chat_id):
+    # Everything hanging off a chat, including its vectors. The chat row
+    # itself is left to the caller.
+    hashes = {row[0] for row in db.query(File.content_hash).filter(File.chat_id == chat_id).all() if row[0]}
+    chat = db.get(Chat, chat_id)
+
+    db.query(ChatMessage).filter(ChatMessage.chat_id == chat_id).delete(synchronize_session=False)
+    db.query(IngestionJob).filter(IngestionJob.chat_id == chat_id).delete(synchronize_session=False)
+    db.query(File).filter(File.chat_id == chat_id).delete(synchronize_session=False)
+    db.commit()
+
+    if chat:
+        index_manager.delete_chat(chat.user_id, chat_id)
+    for content_hash in hashes:
+        if chat:
+            release_file(db, chat.user_id, chat_id, content_hash)
+        else:
+            release_document(db, content_hash)
+
+
+def confirm_dead(live_hashes, live_chats, hashes, chat_ids):
+    # The live sets are a snapshot taken before a long scan. Anything they
+    # miss is looked up again right before it is deleted: an upload that
+    # started since then has its Document row (and chat) committed before
+    # any of its chunks are written. Returns the hashes and chats that are
+    # really gone and adds the others to the live sets.
+    hashes = set(hashes) - live_hashes
+    chat_ids = set(chat_ids) - live_chats
+    if not hashes and not chat_ids:
+        return set(), set()
+
+    db = SessionLocal()
+    try:
+        if hashes:
+            live_hashes.update(row[0] for row in db.query(Document.content_hash)
+                               .filter(Document.content_hash.in_(list(hashes))).all())
+        if chat_ids:
+            live_chats.update(row[0] for row in db.query(Chat.chat_id)
+                              .filter(Chat.chat_id.in_(list(chat_ids))).all())
+    finally:
+        db.close()
+    return hashes - live_hashes, chat_ids - live_chats
+
+
+def reconcile(batch_size=Config.GC_BATCH_SIZE):
+    # Find and purge anything left behind by crashes or older versions:
+    # messages without a chat, documents without files and chunks whose
+    # document or chat no longer exists.
+    stats = {"orphan_messages": 0, "orphan_documents": 0, "orphan_copies": 0, "orphan_chunks": 0, "orphan_lexical": 0,
+             "chunks_scanned": 0}
+    db = SessionLocal()
+    try:
+        chat_ids = select(Chat.chat_id)
+        while True:
+            ids = [row[0] for row in db.query(ChatMessage.message_id)
+                   .filter(ChatMessage.chat_id.notin_(chat_ids))
+                   .limit(batch_size).all()]
+            if not ids:
+                break
+            db.query(ChatMessage).filter(ChatMessage.message_id.in_(ids)).delete(synchronize_session=False)
+            db.commit()
+            stats["orphan_messages"] += len(ids)
+
+        # An upload creates its Document just before its File
+        grace = datetime.utcnow() - timedelta(seconds=Config.GC_GRACE_SECONDS)
+        orphans = db.query(Document.content_hash)\
+            .filter(Document.content_hash.notin_(select(File.content_hash).where(File.content_hash.isnot(None))),
+                    Document.created_at < grace)\
+            .all()
+        for (content_hash,) in orphans:
+            if release_document(db, content_hash):
+                stats["orphan_documents"] += 1
+
+        # Copies in partitions no file routed there uses any more
+        copies = db.query(DocumentPartition.content_hash, DocumentPartition.partition).all()
+        existing = set(index_manager.partitions()) if copies else set()
+        for content_hash, name in copies:
+            if index_manager.release_partition(db, content_hash, name, existing):
+                stats["orphan_copies"] += 1
+
+        live_hashes = {row[0] for row in db.query(Document.content_hash).all()}
+        live_chats = {row[0] for row in db.query(Chat.chat_id).all()}
+    finally:
+        db.close()
+
+    dead_hashes, _ = confirm_dead(live_hashes, live_chats, lexical_index.hashes(), ())
+    for content_hash in dead_hashes:
+        lexical_index.delete(content_hash)
+        stats["orphan_lexical"] += 1
+
+    for name in index_manager.partitions():
+        collection = index_manager.get(name)._collection
+        offset = 0
+        while True:
+            batch = collection.get(include=["metadatas"], limit=batch_size, offset=offset)
+            if not batch["ids"]:
+                break
+            stats["chunks_scanned"] += len(batch["ids"])
+
+            metadatas = [metadata or {} for metadata in batch["metadatas"]]
+            dead_hashes, dead_chats = confirm_dead(
+                live_hashes, live_chats,
+                {metadata["content_hash"] for metadata in metadatas if "content_hash" in metadata},
+                {metadata.get("chat_id") for metadata in metadatas if "content_hash" not in metadata}
+            )
+
+            dead = []
+            for chunk_id, metadata in zip(batch["ids"], metadatas):
+                if "content_hash" in metadata:
+                    if metadata["content_hash"] in dead_hashes:
+                        dead.append(chunk_id)
+                elif metadata.get("chat_id") in dead_chats:
+                    dead.append(chunk_id)
+
+            if dead:
+                collection.delete(ids=dead)
+                stats["orphan_chunks"] += len(dead)
+
+            # Deleted rows shift everything after them back
+            offset += len(batch["ids"]) - len(dead)
+
+    return stats
+
+
+def _reconcile_loop():
+    while True:
+        time.sleep(Config.GC_INTERVAL_SECONDS)
+        try:
+            stats = reconcile()
+            if any(count for name, count in stats.items() if name.startswith("orphan_")):
+                print(f"Vector store reconcile: {stats}")
+        except Exception as e:
+            print(f"Vector store reconcile failed: {e}")
+
+
+def start_reconciler():
+    if not Config.GC_INTERVAL_SECONDS:
+        return
+    threading.Thread(target=_reconcile_loop, name="vector-gc", daemon=True).start()
+
+
+def directory_size(path):
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def compact_collection(client, name, batch_size):
+    old = client.get_collection(name)
+    new = client.create_collection(f"{name}_compacted", metadata=old.metadata)
+
+    offset = 0
+    copied = 0
+    while True:
+        batch = old.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            break
+        new.add(
+            ids=batch["ids"],
+            embeddings=batch["embeddings"],
+            documents=batch["documents"],
+            metadatas=batch["metadatas"]
+        )
+        copied += len(batch["ids"])
+        offset += len(batch["ids"])
+
+    client.delete_collection(name)
+    new.modify(name=name)
+    return copied
+
+
+def compact(batch_size=Config.GC_BATCH_SIZE):
+    # Rebuild every partition from its live chunks so the HNSW indexes and
+    # the Chroma SQLite file drop everything deleted over time. Run it while
+    # the server is stopped.
+    stats = reconcile(batch_size)
+    stats["bytes_before"] = directory_size(Config.CHROMA_DIR)
+
+    copied = 0
+    for name in index_manager.partitions():
+        copied += compact_collection(index_manager.client, name, batch_size)
+
+    database = os.path.join(Config.CHROMA_DIR, "chroma.sqlite3")
+    if os.path.exists(database):
+        conn = sqlite3.connect(database)
+        conn.execute("VACUUM")
+        conn.close()
+
+    stats["chunks_kept"] = copied
+    stats["bytes_after"] = directory_size(Config.CHROMA_DIR)
+    stats["bytes_reclaimed"] = stats["bytes_before"] - stats["bytes_after"]
+    return stats
+
+
+if __name__ == "__main__":
+    # python -m src.vector_gc [reconcile|compact]
+    command = sys.argv[1] if len(sys.argv) > 1 else "reconcile"
+    if command == "compact":
+        print(json.dumps(compact(), indent=2))
+    elif command == "reconcile":
+        print(json.dumps(reconcile(), indent=2))
+    else:
+        print("usage: python -m src.vector_gc [reconcile|compact]")
+        sys.exit(1)
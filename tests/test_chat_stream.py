@@ -0,0 +1,47 @@
+import queue
+import threading
+import time
+from src.fake_models import FakeChatModel
+from src.rag_chain import stream_answer
+
+INPUTS = {"input": "What is a binary tree?", "chat_history": [], "history_summary": "", "syllabus": ""}
+
+
+class CountingChatModel(FakeChatModel):
+    produced: list = []
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for chunk in super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            self.produced.append(chunk)
+            yield chunk
+
+
+def test_disconnect_stops_the_model():
+    # Same shape as the chat endpoint: a producer thread fills a queue until
+    # the response generator sets cancelled when the client goes away
+    llm = CountingChatModel(time_to_first_token=0, tokens_per_second=20, response_tokens=100, produced=[])
+    tokens = queue.Queue()
+    cancelled = threading.Event()
+
+    def produce():
+        for text in stream_answer(INPUTS, [], cancelled, llm=llm):
+            tokens.put(text)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    for _ in range(3):
+        tokens.get(timeout=5)
+
+    cancelled.set()
+    producer.join(timeout=0.5)
+    assert not producer.is_alive()
+
+    stopped_at = len(llm.produced)
+    time.sleep(0.3)
+    assert len(llm.produced) == stopped_at
+    assert stopped_at < 10
+
+
+def test_stream_answer_runs_to_completion():
+    llm = FakeChatModel(time_to_first_token=0, tokens_per_second=0, response_tokens=5)
+    assert len(list(stream_answer(INPUTS, [], threading.Event(), llm=llm))) == 5